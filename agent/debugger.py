@@ -1,6 +1,6 @@
 from command.file import read_file_content
 from core.SurrogateIO import try_create_message, sio_print
-from core.cache import GlobalFlag
+from core.cache import GlobalFlag, Configure
 from core.communicate import communicate
 from core.history import History, MessageRole
 from core.sync.StateManager import StateManager, State
@@ -37,13 +37,16 @@ async def process(description: str, ref=False):
         history.add_message(MessageRole.USER, "你需要完成的任务是："  + description, "")
         if len(test_res) != 0:
             history.add_message(MessageRole.SYSTEM, "当前代码的测试结果：" + test_res, "")
-        reload_code(history, info=False)
+        await reload_code(history, info=False)
         if ref:
-            reload_file(history, info=False)
+            await reload_file(history, info=False)
 
         try_create_message(MsgType.SYSTEM)
         sio_print(f"开始调试器轮次：{count}")
-        think, model = await communicate(history.to_message())
+        # 只有第一轮使用响应缓存：对同一个失败状态重新启动调试器时直接复用上次的方案
+        # 之后的轮次如果命中缓存会得到相同的修改，无法推进调试
+        think, model = await communicate(history.to_message(budget=Configure.get_instance().max_context_tokens),
+                                         use_cache=count == 1)
 
         tool_processor = ToolProcessor()
         res = tool_processor.process(model + "\n <test>")
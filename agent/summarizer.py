@@ -11,7 +11,8 @@ async def process(content: str, send_to_cache: bool = False) -> str:
     prompt = path.read_text(encoding='utf-8')
 
     print("总结子系统启动")
-    _, full_response = await communicate([{'role': 'user', 'content': prompt + content}])
+    # 相同的内容总结结果相同，使用响应缓存
+    _, full_response = await communicate([{'role': 'user', 'content': prompt + content}], use_cache=True)
 
     res = formatter.delete_think(''.join(full_response))
 
@@ -1,9 +1,6 @@
-import pkgutil
-import importlib
+from util.manifest import scan
+from .commands import registry
 
-# 自动加载所有命令模块
-__all__ = []
-for _, module_name, _ in pkgutil.iter_modules(__path__):
-    if not module_name.startswith('_'):
-        importlib.import_module(f'.{module_name}', __name__)
-        __all__.append(module_name)
\ No newline at end of file
+# 按清单登记所有命令，实现模块在命令第一次执行时导入
+for entry in scan(__path__[0], __name__):
+    registry.register_lazy(entry.module, *entry.args, **entry.kwargs)
@@ -11,7 +11,7 @@ from .commands import registry, Command, CommandContext
 )
 class ModelCommand(Command):
     def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
-        return SourceRegistry.sources.keys().__str__(), ""
+        return str(list(SourceRegistry.sources)), ""
 
 @registry.register(
     path="/ai/set",
@@ -26,3 +26,59 @@ class ModelChangeCommand(Command):
             return "源不存在，使用/ai list 检查", ""
         Configure.get_instance().active_ai = args[0]
         return f"已修改AI源为 {args[0]}", ""
+
+
+@registry.register(
+    path="/ai/fallback",
+    description="设置备用AI加载源，主AI源长时间没有响应时同时请求备用源",
+    usage="/ai fallback <AI名|off>"
+)
+class FallbackCommand(Command):
+    def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
+        if not args:
+            return "参数缺失", ""
+        configure = Configure.get_instance()
+        if args[0] == "off":
+            configure.fallback_ai = None
+            return "已关闭备用AI源", ""
+        if args[0] not in SourceRegistry.sources.keys():
+            return "源不存在，使用/ai list 检查", ""
+        configure.fallback_ai = args[0]
+        if args[0] not in configure.active_model:
+            return f"已设置备用AI源为 {args[0]}，请先使用/ai set {args[0]}与/model set设置它的模型", ""
+        return f"已设置备用AI源为 {args[0]}，主AI源{configure.hedge_after}秒内没有输出时启用", ""
+
+
+@registry.register(
+    path="/ai/replay",
+    description="使用Replay源录制或回放AI源的响应，录像集名称使用/model set设置",
+    usage="/ai replay record <AI名> | play [倍速] | rate <token每秒>"
+)
+class ReplayCommand(Command):
+    def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
+        if not args:
+            return "参数缺失", ""
+        configure = Configure.get_instance()
+        if args[0] == "record":
+            if len(args) < 2 or args[1] not in SourceRegistry.sources.keys() or args[1] == "Replay":
+                return "请指定被录制的AI源，使用/ai list 检查", ""
+            configure.replay_mode = "record"
+            configure.replay_target = args[1]
+        elif args[0] == "play":
+            try:
+                configure.replay_speed = float(args[1]) if len(args) > 1 else 1.0
+            except ValueError:
+                return "倍速必须是数字", ""
+            configure.replay_mode = "replay"
+            configure.replay_tokens_per_sec = -1
+        elif args[0] == "rate":
+            try:
+                configure.replay_tokens_per_sec = float(args[1])
+            except (IndexError, ValueError):
+                return "请指定每秒的token数", ""
+            configure.replay_mode = "replay"
+        else:
+            return "未知的操作，可选 record/play/rate", ""
+        configure.active_ai = "Replay"
+        configure.active_model.setdefault("Replay", "default")
+        return f"已切换到Replay源，模式 {configure.replay_mode}，录像集 {configure.active_model['Replay']}", ""
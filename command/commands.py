@@ -1,11 +1,16 @@
 from typing import Dict, List, Tuple, Optional
 
+from util.manifest import import_plugin
+
 # ----------------------
 # 命令模式基础架构
 # ----------------------
 
 class CommandContext(dict):
-    """命令执行上下文"""
+    """
+    命令执行上下文
+    需要异步完成的命令把协程放入 context['pending']，由主循环在开始下一轮对话前等待
+    """
     pass
 
 class Command:
@@ -65,6 +70,21 @@ class CommandRoot(Command):
     def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
         return "请输入有效命令（使用 /help 查看可用命令）", ""
 
+class LazyCommand(Command):
+    """清单中登记的命令，第一次执行时导入实现模块，由模块中的注册装饰器替换为真正的命令"""
+    def __init__(self, name: str, module: str, description: str = "", usage=None):
+        super().__init__(name=name, description=description, usage=usage)
+        self.module = module
+
+    def handle(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
+        if args and args[0] in self.subcommands:
+            return self.subcommands[args[0]].handle(args[1:], context)
+        import_plugin(self.module)
+        command = self.parent.subcommands[self.name]
+        if command is self:
+            raise RuntimeError(f"模块 {self.module} 未注册命令 {self.get_full_command()}")
+        return command.handle(args, context)
+
 # ----------------------
 # 命令注册装饰器
 # ----------------------
@@ -74,27 +94,36 @@ class CommandRegistry:
         self.root = CommandRoot()
         self._commands = {}
 
+    def _locate(self, path: str) -> Tuple[Command, str]:
+        """构建命令层级，返回最后一级命令的父命令与名称"""
+        parts = path.strip('/').split('/')
+        current = self.root
+        for part in parts[:-1]:
+            if part not in current.subcommands:  # 中间路径
+                current.add_subcommand(Command(name=part, description=f"{part}命令组"))
+            current = current.subcommands[part]
+        return current, parts[-1]
+
     def register(self, path: str, **kwargs):
-        """命令注册装饰器"""
+        """命令注册装饰器，已登记的占位命令被替换为真正的命令"""
         def decorator(cls):
-            parts = path.strip('/').split('/')
-            current = self.root
-
-            # 构建命令层级
-            for idx, part in enumerate(parts):
-                if part not in current.subcommands:
-                    if idx == len(parts)-1:  # 最后一级命令
-                        cmd = cls(name=part, **kwargs)
-                        current.add_subcommand(cmd)
-                    else:  # 中间路径
-                        temp_cmd = Command(name=part, description=f"{part}命令组")
-                        current.add_subcommand(temp_cmd)
-                        current = temp_cmd
-                else:
-                    current = current.subcommands[part]
+            parent, name = self._locate(path)
+            placeholder = parent.subcommands.get(name)
+            if placeholder is None or isinstance(placeholder, LazyCommand):
+                cmd = cls(name=name, **kwargs)
+                if placeholder is not None:
+                    for sub in placeholder.subcommands.values():
+                        cmd.add_subcommand(sub)
+                parent.add_subcommand(cmd)
             return cls
         return decorator
 
+    def register_lazy(self, module: str, path: str, **kwargs):
+        """按清单登记命令，只记录路径与说明，不导入实现模块"""
+        parent, name = self._locate(path)
+        if name not in parent.subcommands:
+            parent.add_subcommand(LazyCommand(name, module, kwargs.get("description", ""), kwargs.get("usage")))
+
 registry = CommandRegistry()
 
 
@@ -107,6 +136,7 @@ class CommandHandler:
     def __init__(self):
         self.running = True
         self.registry = registry
+        self.pending = None  # 上一条命令留下的协程
 
     def handle_command(self, user_input: str) -> Tuple[str, str]:
         """处理用户输入"""
@@ -123,10 +153,17 @@ class CommandHandler:
             # 执行命令链
             result, content = self.registry.root.handle(parts, context)
             self.running = context.get('running', self.running)
+            self.pending = context.get('pending')
             return result, content
         except Exception as e:
             return f"命令执行错误: {str(e)}", ""
 
+    async def wait_pending(self):
+        """等待上一条命令留下的协程完成"""
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            await pending
+
 
 registry.register(path="/fetch",
                   description="网页内容获取",
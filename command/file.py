@@ -3,6 +3,7 @@ import json
 from pathlib import Path
 from typing import List, Tuple
 from core.cache import CatchInformation
+from core.extract import ExtractStore, run_extractor
 
 from .commands import registry, Command, CommandContext
 
@@ -34,6 +35,18 @@ def read_file_content(filepath: str) -> str:
 
     suffix = path.suffix.lower()
 
+    # 解析开销大的格式优先使用项目的持久化提取缓存
+    if suffix in EXTRACTORS:
+        extractor, version = EXTRACTORS[suffix]
+        store = ExtractStore.get_instance()
+        if store is None:
+            return run_extractor(extractor, path)
+        text = store.get(path, version)
+        if text is None:
+            text = run_extractor(extractor, path)
+            store.put(path, version, text)
+        return text
+
     if suffix == '.txt':
         return path.read_text(encoding='utf-8')
     elif suffix == '.csv':
@@ -42,14 +55,6 @@ def read_file_content(filepath: str) -> str:
         return json_to_text(path)
     elif suffix == '.py':
         return f"带行号的Python代码文件内容:\n```python\n{read_python_code(path)}\n```"
-    elif suffix == '.pdf':
-        return pdf_to_text(path)
-    elif suffix in ('.docx', '.doc'):
-        return docx_to_text(path)
-    elif suffix in ('.pptx', '.ppt'):
-        return pptx_to_text(path)
-    elif suffix in ('.xlsx', '.xls'):
-        return excel_to_text(path)
     else:
         raise ValueError(f"不支持的文件格式: {suffix}")
 
@@ -151,4 +156,17 @@ def excel_to_text(filepath: Path) -> str:
             )
         return "\n\n".join(output)
     except Exception as e:
-        raise RuntimeError(f"读取Excel文件失败: {str(e)}")
\ No newline at end of file
+        raise RuntimeError(f"读取Excel文件失败: {str(e)}")
+
+
+# 需要持久化缓存的提取器: 后缀 -> (提取函数, 提取器版本)
+# 修改提取逻辑后需要递增版本号，使旧的缓存失效
+EXTRACTORS = {
+    '.pdf': (pdf_to_text, 1),
+    '.docx': (docx_to_text, 1),
+    '.doc': (docx_to_text, 1),
+    '.pptx': (pptx_to_text, 1),
+    '.ppt': (pptx_to_text, 1),
+    '.xlsx': (excel_to_text, 1),
+    '.xls': (excel_to_text, 1),
+}
@@ -0,0 +1,28 @@
+import sys
+from typing import List, Tuple
+
+from util.manifest import IMPORT_TIMES, PLUGIN_MODULES
+from .commands import registry, Command, CommandContext
+
+# 导入开销较大的第三方库
+HEAVY_MODULES = ("ollama", "openai", "requests", "bs4", "googleapiclient", "pandas", "numpy", "PyPDF2", "docx",
+                 "pptx")
+
+
+@registry.register(
+    path="/imports",
+    description="查看插件模块的导入耗时，用于检查启动速度"
+)
+class ImportsCommand(Command):
+    def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
+        lines = ["按需导入的插件模块:"]
+        for module, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+            lines.append(f"  {module.ljust(28)} {seconds * 1000:8.1f} ms")
+        lines.append(f"  合计 {sum(IMPORT_TIMES.values()) * 1000:.1f} ms")
+
+        pending = sorted(module for module in PLUGIN_MODULES if module not in sys.modules)
+        lines.append(f"尚未导入的插件模块: {', '.join(pending) if pending else '无'}")
+
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+        lines.append(f"已加载的大型依赖: {', '.join(loaded) if loaded else '无'}")
+        return "\n".join(lines), ""
@@ -1,7 +1,5 @@
 from typing import List, Tuple
 
-import ollama
-
 from .commands import registry, Command, CommandContext
 from core.cache import Configure
 
@@ -11,7 +9,15 @@ from core.cache import Configure
 )
 class ModelCommand(Command):
     def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
-        return ollama.list, ""
+        try:
+            import ollama
+        except ImportError:
+            return "请安装ollama库以使用Ollama模型: pip install ollama", ""
+        try:
+            models = ollama.list().models
+        except Exception as e:
+            return f"获取ollama模型列表失败: {e}", ""
+        return "\n".join(model.model for model in models) or "没有本地可用的ollama模型", ""
 
 @registry.register(
     path="/model/set",
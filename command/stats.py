@@ -0,0 +1,49 @@
+from typing import List, Tuple
+
+from core.metrics import Metrics, percentile
+from .commands import registry, Command, CommandContext
+
+# 请求指标的显示名称
+REQUEST_LABELS = {
+    "send": "发送请求",
+    "ttft": "首token",
+    "first_content": "首个回复token",
+    "duration": "总耗时",
+    "tokens_per_sec": "生成速度",
+}
+
+
+def _format(values: list[float], key: str = "") -> str:
+    p50, p95 = percentile(values, 0.5), percentile(values, 0.95)
+    if key == "tokens_per_sec":
+        return f"p50 {p50:8.1f} / p95 {p95:8.1f} tokens/秒"
+    return f"p50 {p50 * 1000:8.1f} / p95 {p95 * 1000:8.1f} ms"
+
+
+@registry.register(
+    path="/stats",
+    description="查看本次会话各阶段耗时与模型请求延迟的p50/p95"
+)
+class StatsCommand(Command):
+    def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
+        metrics = Metrics.get_instance()
+        summary = metrics.summary()
+        lines = [f"本次会话共{len(metrics.turns)}轮对话，{len(metrics.requests)}次模型请求"]
+        hedged = sum(1 for request in metrics.requests if request.get("hedged"))
+        if hedged:
+            lines.append(f"其中{hedged}次请求由备用AI源完成")
+        cached = sum(1 for request in metrics.requests if request.get("cached"))
+        if cached:
+            lines.append(f"其中{cached}次请求命中本地响应缓存")
+
+        if summary["phases"]:
+            lines.append("各阶段耗时:")
+            for name, values in sorted(summary["phases"].items()):
+                lines.append(f"  {name.ljust(20)} {_format(values)}")
+
+        for (source, model), group in summary["requests"].items():
+            lines.append(f"{source} / {model}:")
+            for key, label in REQUEST_LABELS.items():
+                if key in group:
+                    lines.append(f"  {label.ljust(14)} {_format(group[key], key)}")
+        return "\n".join(lines), ""
@@ -11,5 +11,8 @@ from core.cache import CatchInformation
 class SummaryCommand(Command):
     def execute(self, args: List[str], context: CommandContext) -> Tuple[str, str]:
         info = CatchInformation.get_instance().info
-        summarizer.process(info, send_to_cache=True)
-        return "", ""
\ No newline at end of file
+        if not info:
+            return "没有可总结的缓存内容", ""
+        # 命令同步执行，总结交给主循环等待，完成前不开始下一轮对话，避免与主AI的输出交错
+        context['pending'] = summarizer.process(info, send_to_cache=True)
+        return "开始总结缓存内容", ""
\ No newline at end of file
@@ -1,27 +1,97 @@
+import asyncio
 import re
+import time
 
 from core.cache import GlobalFlag
 from tui.message import MsgType
 
+# 终端颜色控制符，界面中不显示
+ANSI_PATTERN = re.compile(r'\x1b\[\d+m')
 
-def sio_print(msg, end="\n", flush=False)->None:
-    """
-    根据APP启用与否，将数据转发到APP的消息显示组件，或者打印到终端
-    """
+_display_cache = None  # (APP实例, 消息显示组件)
+
+
+def _display():
+    """消息显示组件，缓存引用避免每次输出都查询组件树，APP重建时重新查询"""
+    global _display_cache
     from tui.ChatAPP import ChatApp
     from tui.message import MessageDisplay
 
+    app = ChatApp.instance
+    if _display_cache is None or _display_cache[0] is not app:
+        _display_cache = (app, app.query_one(MessageDisplay))
+    return _display_cache[1]
+
+
+def _emit(msg: str, end: str, flush: bool):
     if GlobalFlag.get_instance().is_app_running:
-        # 使用正则表达式去除
-        msg = re.sub(r'\x1b\[\d+m', '', msg)
-        ChatApp.instance.query_one(MessageDisplay).append_content(msg+end)
-        ChatApp.instance.query_one(MessageDisplay).add_content(msg+end)
+        msg = ANSI_PATTERN.sub('', str(msg) + end)
+        display = _display()
+        display.append_content(msg)
+        display.add_content(msg)
     else:
         print(msg, end=end, flush=flush)
 
 
+class StreamSink:
+    """
+    流式输出的缓冲区
+    文本先写入缓冲区，遇到换行或距上次刷新超过1/FPS秒时才写入界面，否则安排一次延迟刷新
+    输出结束时需要调用flush写入剩余的文本
+    """
+    FPS = 20
+    instance = None
+
+    def __init__(self):
+        self.pending: list[str] = []
+        self.last_flush = 0.0
+        self.timer: asyncio.TimerHandle = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def write(self, text: str):
+        if not text:
+            return
+        self.pending.append(text)
+        elapsed = time.monotonic() - self.last_flush
+        if "\n" in text or elapsed >= 1 / self.FPS:
+            self.flush()
+        elif self.timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 没有事件循环时等待下一次写入或最终刷新
+                return
+            self.timer = loop.call_later(1 / self.FPS - elapsed, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending.clear()
+        self.last_flush = time.monotonic()
+        _emit(text, "", True)
+
+
+def sio_print(msg, end="\n", flush=False)->None:
+    """
+    根据APP启用与否，将数据转发到APP的消息显示组件，或者打印到终端
+    """
+    # 先输出缓冲中的流式文本，保持输出顺序
+    if StreamSink.instance is not None:
+        StreamSink.instance.flush()
+    _emit(msg, end, flush)
+
+
 def try_create_message(role: MsgType, content: str="", think: str = "") -> None:
-    from tui.ChatAPP import ChatApp
-    from tui.message import MessageDisplay
+    if StreamSink.instance is not None:
+        StreamSink.instance.flush()
     if GlobalFlag.get_instance().is_app_running:
-        ChatApp.instance.query_one(MessageDisplay).create_message(role, content, think)
+        _display().create_message(role, content, think)
@@ -7,7 +7,11 @@ class Configure:
 
     def __init__(self, active_model: dict = None, google_api_key: str = "", google_cse_id: str = "",
                  active_ai: str = None, openai_api_key: str = "", siliconflow_api_key: str = "",
-                 max_skip_input_turn: int = -1, deepseek_api_key: str = ""):
+                 max_skip_input_turn: int = -1, deepseek_api_key: str = "", max_context_tokens: int = -1,
+                 ref_top_k: int = 8, ref_full_inject_tokens: int = 8000, http_max_connections: int = 10,
+                 http_max_keepalive: int = 5, http_keepalive_expiry: float = 60.0, fallback_ai: str = None,
+                 hedge_after: float = 15.0, replay_mode: str = "replay", replay_target: str = None,
+                 replay_dir: str = "", replay_speed: float = 1.0, replay_tokens_per_sec: float = -1):
         if active_model is None:
             active_model = {}
         self.active_model = active_model
@@ -18,6 +22,19 @@ class Configure:
         self.siliconflow_api_key = siliconflow_api_key
         self.max_skip_input_turn: int = max_skip_input_turn # 最大连续跳过用户输入轮次。超过此轮次将强制停止AI控制。为-1时不限制
         self.deepseek_api_key = deepseek_api_key
+        self.max_context_tokens: int = max_context_tokens # 发送给模型的最大token数，超出时省略低优先级的消息。为-1时不限制
+        self.ref_top_k: int = ref_top_k # 参考文献较多时每轮检索注入的片段数
+        self.ref_full_inject_tokens: int = ref_full_inject_tokens # 参考文献总token数不超过此值时全部注入，超过时改为检索。为-1时总是全部注入
+        self.http_max_connections: int = http_max_connections # 每个AI源客户端的最大连接数
+        self.http_max_keepalive: int = http_max_keepalive # 每个AI源客户端保持的空闲连接数
+        self.http_keepalive_expiry: float = http_keepalive_expiry # 空闲连接保持的秒数
+        self.fallback_ai: str = fallback_ai # 备用AI源，使用active_model中对应的模型
+        self.hedge_after: float = hedge_after # 主AI源超过此秒数没有输出时同时请求备用源。为-1时不使用备用源
+        self.replay_mode: str = replay_mode # Replay源的模式，record录制，replay回放
+        self.replay_target: str = replay_target # 录制模式下被录制的AI源
+        self.replay_dir: str = replay_dir # 录像目录，为空时使用项目目录下的replay/
+        self.replay_speed: float = replay_speed # 回放速度倍数，为0时不等待
+        self.replay_tokens_per_sec: float = replay_tokens_per_sec # 大于0时按固定的token速率回放，忽略录制的间隔
 
     def save(self):
         save_cache(self)
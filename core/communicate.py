@@ -1,17 +1,30 @@
-import asyncio
 import time
-from copy import copy
 
 from colorama import Fore, Style
 
-from core.SurrogateIO import sio_print, try_create_message
+from core.SurrogateIO import StreamSink, sio_print, try_create_message
 from core.cache import Configure, GlobalFlag
-from core.source.sources import SourceRegistry, BaseSource
+from core.history import system_as_user
+from core.metrics import RequestTimer
+from core.response_cache import ResponseCache
+from core.source.sources import SourceRegistry, BaseSource, close_stream
+from core.token import TokenCounter
 from tui.message import MsgType
 from util.fomatter import delete_think
+from util.sentinel import SentinelMatcher
+from util.stage import StageCache
 
 
-async def communicate(message) -> [str, str]:
+# 流式输出中需要本地匹配的标记
+# 不交给服务端作为停止序列：服务端会把停止序列从回复中去掉，保存的回复需要保留标记，后续轮次的模型才能看到完整的协议
+SENTINELS = ("<wait>", "<end>")
+
+
+async def communicate(message, use_cache: bool = False) -> [str, str]:
+    """
+    将消息发送给当前AI源并流式输出回复，返回(思考过程, 回复)
+    use_cache为True时先查询本地响应缓存，相同的AI源、模型与消息直接返回上次的结果
+    """
     configure = Configure.get_instance()
     # 检查模型
     if Configure.get_instance().active_model is None:
@@ -29,57 +42,115 @@ async def communicate(message) -> [str, str]:
     if not source_cls.is_available():
         raise Exception("AI源可用性检验未通过")
 
+    # 检查上下文大小
+    tokens = TokenCounter.count_messages(message)
+    if configure.max_context_tokens != -1 and tokens > configure.max_context_tokens:
+        try_create_message(MsgType.SYSTEM)
+        sio_print(f"上下文约{tokens} tokens，超过了设置的最大值{configure.max_context_tokens}")
+
+    timer = RequestTimer(configure.active_ai, configure.active_model[configure.active_ai])
+    # 查询响应缓存
+    cache = ResponseCache.get_instance() if use_cache else None
+    if cache is not None:
+        key = ResponseCache.key(configure.active_ai, configure.active_model[configure.active_ai], message)
+        cached = cache.get(key)
+        if cached is not None:
+            timer.cache_hit()
+            try_create_message(MsgType.ASSISTANT)
+            sio_print("\nAI回复(来自缓存): ", end='', flush=True)
+            sio_print(cached[1])
+            return cached
+
     # ------------------------------
     # 调用模型
     # ------------------------------
 
-    # 替换message中的所有system为user以匹配模型的输入
-    # 去除所有非开头的system
-    flag = False
-    for i in range(len(message)):
-        if message[i]['role'] != 'system':
-            flag = True
-        if message[i]['role'] == 'system' and flag:
-            message[i]['role'] = 'user'
-            message[i]['content'] = "[系统消息] !该内容由系统根据流程生成! "+message[i]['content'] + "[系统消息结束]"
-            message[i]['system'] = True
-
-    stream = source_cls.create_stream(copy(message))
+    # <wait>与<end>在本地匹配，匹配后关闭连接使服务商停止生成
+    # 主AI源长时间没有输出时由SourceRegistry同时请求备用源，使用先输出的一方
+    # 发送耗时在主AI源的请求发出时记录，不包括等待首token的时间
+    source_cls, stream, hedged = await SourceRegistry.open_stream(rewrite_system(message), on_sent=timer.sent)
+    if hedged:
+        timer.set_source(source_cls.source_name, configure.active_model[source_cls.source_name], hedged=True)
+        try_create_message(MsgType.SYSTEM)
+        sio_print(f"{configure.active_ai} 在{configure.hedge_after}秒内没有响应，已使用备用AI源 {source_cls.source_name}")
 
     GlobalFlag.get_instance().is_communicating = True
     try_create_message(MsgType.ASSISTANT)
     sio_print("\nAI回复: ", end='', flush=True)
-    think, full_response = await process_stream(stream, source_cls)
+    think, full_response = await process_stream(stream, source_cls, timer)
+    if cache is not None and full_response:
+        # 与查询使用同一个键，由备用源完成的回复同样保存在当前AI源下，下次查询才能命中
+        cache.put(key, think, full_response)
     return think, full_response
 
 
-async def process_stream(stream, source_cls: BaseSource.__class__) -> [str, str]:
-    """实时将流式响应写入Markdown文件"""
+_system_as_user = StageCache(system_as_user)
+
+
+def rewrite_system(message: list[dict]) -> list[dict]:
+    """
+    替换message中的所有非开头的system为user以匹配模型的输入
+    返回新的列表，不修改传入的消息。改写结果按消息对象缓存，未变化的消息不会重复改写
+    """
+    flag = False
+    to_rewrite = []
+    for msg in message:
+        if msg['role'] != 'system':
+            flag = True
+        elif flag:
+            to_rewrite.append(msg)
+    rewritten = dict(zip(map(id, to_rewrite), _system_as_user(to_rewrite)))
+    return [rewritten.get(id(msg), msg) for msg in message]
+
+
+async def process_stream(stream, source_cls: BaseSource.__class__, timer: RequestTimer = None) -> [str, str]:
+    """实时将流式响应写入Markdown文件，timer不为None时记录首token时间与生成速度"""
     try:
         start_time = time.time()
         sio_print(f"\n{Fore.BLUE}------------------------------------------------------{Style.RESET_ALL}")
         full_response = []
         full_think = []
+        usage = None
+        # 流式文本经缓冲区批量写入界面，接收数据的循环不等待界面刷新
+        sink = StreamSink.get_instance()
+        matcher = SentinelMatcher(SENTINELS)
         try:
-            for chunk in stream:
-                think_content, content = source_cls.catch_chunk_in_stream(chunk)
-                await asyncio.sleep(0.05)
-                sio_print(f"{Fore.LIGHTBLACK_EX}{think_content}{Style.RESET_ALL}", end='', flush=True)
-                if len(full_response) == 0 and len(content) != 0:
-                    sio_print("\n\n")
-                sio_print(content, end='', flush=True)
-                full_response.append(content)
-                # 如果最近的5段content组合中存在 <wait>, <end>，则停止
-                if len(full_response) >= 5:
-                    if "<wait>" in "".join(full_response[-5:]) or "<end>" in "".join(full_response[-5:]):
-                        if "<end>" in "".join(full_response[-5:]):
+            try:
+                async for chunk in stream:
+                    usage = source_cls.catch_usage_in_stream(chunk) or usage
+                    think_content, content = source_cls.catch_chunk_in_stream(chunk)
+                    if timer is not None:
+                        timer.chunk(think_content, content)
+                    if think_content:
+                        sink.write(f"{Fore.LIGHTBLACK_EX}{think_content}{Style.RESET_ALL}")
+                    if len(full_response) == 0 and len(content) != 0:
+                        sink.write("\n\n")
+                    sink.write(content)
+                    full_response.append(content)
+                    full_think.append(think_content)
+                    # 出现 <wait>, <end> 时停止，并关闭连接使服务商停止生成
+                    sentinel = matcher.feed(content)
+                    if sentinel is not None:
+                        if sentinel == "<end>":
                             GlobalFlag.get_instance().force_stop = True
                         break
-                full_think.append(think_content)
+            finally:
+                sink.flush()
+                await close_stream(stream)
             # 处理full_think
             full_think = "".join(full_think)
             full_response = ''.join(full_response)
-            sio_print(f"{Fore.BLUE}\n耗时{time.time()-start_time:.2f}秒\n--------------------"
+            elapsed = f"耗时{time.time()-start_time:.2f}秒"
+            if timer is not None:
+                timer.finish(usage, full_think, full_response)
+                if "ttft" in timer.record:
+                    elapsed += f"，首token {timer.record['ttft']:.2f}秒"
+                if "tokens_per_sec" in timer.record:
+                    elapsed += f"，{timer.record['tokens_per_sec']:.1f} tokens/秒"
+            sio_print(f"{Fore.BLUE}\n{elapsed}")
+            if usage is not None:
+                sio_print(format_usage(usage))
+            sio_print(f"--------------------"
                   f"----------------------------------{Style.RESET_ALL}")
         except KeyboardInterrupt:
             sio_print("\n检测到中断信号，打断模型输出，抛弃未完成的信息")
@@ -91,3 +162,12 @@ async def process_stream(stream, source_cls: BaseSource.__class__) -> [str, str]
     except Exception as e:
         sio_print(f"\n文件写入错误: {str(e)}")
         return None
+
+
+def format_usage(usage: dict) -> str:
+    """格式化用量统计，包含服务商前缀缓存的命中情况"""
+    text = f"输入{usage['prompt_tokens']} tokens，输出{usage['completion_tokens']} tokens"
+    if usage['cached_tokens'] is not None and usage['prompt_tokens']:
+        text += (f"，前缀缓存命中{usage['cached_tokens']} tokens"
+                 f"({usage['cached_tokens'] / usage['prompt_tokens']:.0%})")
+    return text
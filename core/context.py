@@ -0,0 +1,199 @@
+# 增量上下文组装器
+# 缓存提示词、工具、参考文件与代码空间的解析结果，每轮只重新读取发生变化的文件
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+from command.file import read_file_content
+from core.extract import ExtractStore
+from core.history import Message, MessageRole
+from core.token import TokenCounter
+from util.storage import file_digest
+
+
+@dataclass
+class FileEntry:
+    """单个文件的缓存条目，以(路径, 大小, 修改时间, 内容哈希)为键"""
+    path: str
+    size: int
+    mtime: int
+    digest: str
+    content: str
+
+
+# 各类上下文消息的渲染方式: 标签 -> (发送给模型的内容, 展示给用户的内容)
+RENDERERS = {
+    "prompt": (lambda path, content: content, lambda path: f"加载提示词 {path.name}"),
+    "tool": (lambda path, content: f"加载*工具*信息{path.stem}" + content, lambda path: ""),
+    "file": (lambda path, content: content, lambda path: ""),
+    "code": (lambda path, content: f"*代码空间*可编辑文件{path.name}" + content, lambda path: ""),
+}
+
+# 并发读取文件的线程数，读取以IO与等待提取进程为主，可以多于CPU核数
+LOAD_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class ContextAssembler:
+    """
+    增量上下文组装器
+    文件的大小与修改时间未变时直接复用缓存，变化时先比较内容哈希，哈希也变化才重新解析
+    目录列表以目录修改时间为键缓存，只有增删文件时才重新扫描
+    """
+    instance = None
+
+    def __init__(self):
+        self.entries: dict[str, FileEntry] = {}
+        self.listings: dict[str, tuple[int, list[Path]]] = {}
+        self.rendered: dict[tuple[str, str], tuple[str, str]] = {}  # (标签, 路径) -> (内容哈希, 渲染结果)
+        self.token_counts: dict[str, tuple[str, int, int]] = {}  # 路径 -> (内容哈希, 分词器版本, token数)
+        self.pool = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix="context-loader")
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def list_files(self, directory: Path) -> list[Path]:
+        """
+        列出目录下的所有文件
+        目录未变化时返回同一个列表对象，调用方可以据此判断列表是否更新
+        """
+        key = str(directory)
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            if key in self.listings:
+                for file in self.listings.pop(key)[1]:
+                    self.forget(file)
+            return []
+
+        cached = self.listings.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        files = [file for file in directory.iterdir() if file.is_file()]
+        if cached is not None:
+            # 移除已删除文件的缓存
+            for file in set(cached[1]) - set(files):
+                self.forget(file)
+        self.listings[key] = (mtime, files)
+        return files
+
+    def read(self, path: Path) -> FileEntry:
+        """读取文件，未变化时返回缓存内容。解析失败的异常原样抛出"""
+        key = str(path)
+        stat = path.stat()
+        entry = self.entries.get(key)
+        if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime_ns:
+            return entry
+
+        digest = file_digest(path)
+        if entry is not None and entry.digest == digest:
+            # 仅修改时间变化，内容相同
+            entry.size, entry.mtime = stat.st_size, stat.st_mtime_ns
+            return entry
+
+        entry = FileEntry(key, stat.st_size, stat.st_mtime_ns, digest, read_file_content(path))
+        self.entries[key] = entry
+        return entry
+
+    def build(self, tag: str, path: Path) -> Message:
+        """读取文件并生成对应标签的上下文消息"""
+        entry = self.read(path)
+        for_model, for_user = RENDERERS[tag]
+        # 内容未变时复用同一个字符串对象，History.splice可以据此跳过更新
+        rendered = self.rendered.get((tag, entry.path))
+        if rendered is None or rendered[0] != entry.digest:
+            rendered = (entry.digest, for_model(path, entry.content))
+            self.rendered[(tag, entry.path)] = rendered
+        return Message(MessageRole.SYSTEM, rendered[1], for_user(path), tags=[tag], source=entry.path,
+                       digest=entry.digest)
+
+    async def load(self, tag: str, files: list[Path],
+                   progress: Optional[Callable[[Path, int, int], Awaitable]] = None) -> list[Union[Message, Exception]]:
+        """
+        在线程池中并发读取多个文件并生成上下文消息，不阻塞事件循环
+        返回结果与files的顺序一致，读取失败的文件对应位置为异常对象
+        progress在每个文件完成时调用，参数为(文件, 已完成数, 总数)
+        """
+        loop = asyncio.get_running_loop()
+        finished = 0
+
+        async def build(file: Path):
+            nonlocal finished
+            try:
+                return await loop.run_in_executor(self.pool, self.build, tag, file)
+            except Exception as e:
+                return e
+            finally:
+                finished += 1
+                if progress is not None:
+                    await progress(file, finished, len(files))
+
+        return list(await asyncio.gather(*(build(file) for file in files)))
+
+    def token_total(self, messages: list[Message]) -> int:
+        """由文件生成的消息的token总数，按文件的内容哈希缓存，未变化的文件不重新计数"""
+        total = 0
+        for msg in messages:
+            cached = self.token_counts.get(msg.source)
+            if cached is None or cached[0] != msg.digest or cached[1] != TokenCounter.generation:
+                cached = (msg.digest, TokenCounter.generation, msg.tokens)
+                self.token_counts[msg.source] = cached
+            total += cached[2]
+        return total
+
+    def forget(self, path: Path):
+        """文件被删除时移除内存缓存与持久化的提取文本"""
+        self.invalidate(path)
+        store = ExtractStore.get_instance()
+        if store is not None:
+            store.evict(path)
+
+    @staticmethod
+    def order(messages: list[Message]) -> list[Message]:
+        """
+        按来源路径排序，使上下文的排列与文件系统的遍历顺序无关
+        同样的文件集合每轮得到完全相同的前缀，便于服务商的前缀缓存命中
+        修改某个文件只改变它自己的位置，不会打乱其后文件的顺序
+        """
+        return sorted(messages, key=lambda msg: (msg.source or "", msg.digest or ""))
+
+    def apply_events(self, events: list):
+        """
+        根据目录监视的事件使缓存失效，参数为core.watcher.FileEvent列表
+        删除的文件同时移除提取文本，新增或删除文件时重新扫描所在目录
+        """
+        for event in events:
+            if event.kind == "rescan":
+                self._stale_listing(event.path)
+                continue
+            if event.kind == "remove":
+                self.forget(event.path)
+            else:
+                self.invalidate(event.path)
+            if event.kind != "modify":
+                self._stale_listing(event.path.parent)
+
+    def _stale_listing(self, directory: Path):
+        """标记目录列表需要重新扫描，保留旧列表以便移除已删除文件的缓存"""
+        cached = self.listings.get(str(directory))
+        if cached is not None:
+            self.listings[str(directory)] = (-1, cached[1])
+
+    def invalidate(self, path: Path = None):
+        """使某个文件的缓存失效，不指定路径时清空所有缓存"""
+        if path is None:
+            self.entries.clear()
+            self.listings.clear()
+            self.rendered.clear()
+            self.token_counts.clear()
+            return
+        self.entries.pop(str(path), None)
+        self.token_counts.pop(str(path), None)
+        for tag in RENDERERS:
+            self.rendered.pop((tag, str(path)), None)
@@ -0,0 +1,149 @@
+# 文件提取文本的持久化存储
+# PDF、Word等格式的解析开销很大，而同一个文件的解析结果不会变化，因此按项目缓存到磁盘
+import json
+import mmap
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from pickle import PicklingError
+from typing import Callable, Optional
+
+from core.Project import Project
+from util.storage import atomic_write, file_digest
+
+
+# 提取进程池，PDF等格式的解析是CPU密集的纯Python代码，放到独立进程中才能利用多核
+# 进程池按需启动进程，实际的进程数为min(CPU核数, 同时提取的文件数)
+_extract_pool: Optional[ProcessPoolExecutor] = None
+_extract_pool_lock = threading.Lock()
+_extracting = 0  # 正在提取的文件数
+# 同时提取的文件数少于此值且进程池未启动时在当前线程执行，启动spawn进程的开销大于解析单个文件
+INLINE_BATCH = 2
+
+
+def run_extractor(extractor: Callable[[Path], str], path: Path) -> str:
+    """在进程池中运行提取函数，只有少量文件需要提取或进程池不可用时在当前线程执行"""
+    global _extract_pool, _extracting
+    with _extract_pool_lock:
+        _extracting += 1
+        inline = _extract_pool is None and _extracting < INLINE_BATCH
+    try:
+        if inline:
+            return extractor(path)
+        try:
+            with _extract_pool_lock:
+                if _extract_pool is None:
+                    _extract_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                        mp_context=multiprocessing.get_context("spawn"))
+                pool = _extract_pool
+            return pool.submit(extractor, path).result()
+        except (BrokenProcessPool, OSError, PicklingError):
+            with _extract_pool_lock:
+                _extract_pool = None
+            return extractor(path)
+    finally:
+        with _extract_pool_lock:
+            _extracting -= 1
+
+
+class ExtractStore:
+    """
+    项目级的提取文本存储，位于 projects/<项目名>/.cache/extract/
+    条目以源文件内容哈希与提取器版本为键，命中时通过内存映射读取
+    index.json 记录每个源文件的大小、修改时间与哈希，未变化的文件无需重新计算哈希
+    """
+    instances: dict[str, 'ExtractStore'] = {}
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.index_file = root / "index.json"
+        self.lock = threading.Lock()
+        self.sources: dict[str, dict] = {}  # 源文件路径 -> {size, mtime, digest, key}
+        try:
+            self.sources = json.loads(self.index_file.read_text(encoding='utf-8'))
+        except Exception:
+            self.sources = {}
+        self.evict_missing()
+
+    @classmethod
+    def get_instance(cls) -> Optional['ExtractStore']:
+        """获取当前项目的存储，未选择项目时返回None"""
+        if Project.instance is None:
+            return None
+        root = Project.instance.root_path / ".cache" / "extract"
+        key = str(root)
+        if key not in cls.instances:
+            root.mkdir(parents=True, exist_ok=True)
+            cls.instances[key] = cls(root)
+        return cls.instances[key]
+
+    def get(self, path: Path, version: int) -> Optional[str]:
+        """读取缓存的提取文本，未命中时返回None"""
+        key = self._key(path, version)
+        entry = self.root / f"{key}.txt"
+        try:
+            with entry.open('rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return str(mm, 'utf-8')
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, path: Path, version: int, text: str):
+        """写入提取文本"""
+        key = self._key(path, version)
+        atomic_write(self.root / f"{key}.txt", text.encode('utf-8'))
+
+    def evict(self, path: Path):
+        """源文件被删除时移除对应条目"""
+        with self.lock:
+            info = self.sources.pop(str(path), None)
+            if info is None:
+                return
+            self._drop_unreferenced(info["key"])
+            self._save_index()
+
+    def evict_missing(self):
+        """移除所有源文件已不存在的条目"""
+        with self.lock:
+            missing = [source for source in self.sources if not Path(source).exists()]
+            for source in missing:
+                self._drop_unreferenced(self.sources.pop(source)["key"])
+            if missing:
+                self._save_index()
+
+    def _key(self, path: Path, version: int) -> str:
+        """根据源文件的内容哈希与提取器版本计算条目键，源文件未变化时复用索引中的哈希"""
+        stat = path.stat()
+        source = str(path)
+        with self.lock:
+            info = self.sources.get(source)
+            if info is not None and info["size"] == stat.st_size and info["mtime"] == stat.st_mtime_ns:
+                if info["key"].endswith(f"-v{version}"):
+                    return info["key"]
+                digest = info["digest"]
+            else:
+                digest = None
+        if digest is None:
+            digest = file_digest(path)
+        key = f"{digest}{path.suffix.lower().replace('.', '-')}-v{version}"
+        with self.lock:
+            old = self.sources.get(source)
+            self.sources[source] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "digest": digest, "key": key}
+            if old is not None and old["key"] != key:
+                self._drop_unreferenced(old["key"])
+            self._save_index()
+        return key
+
+    def _drop_unreferenced(self, key: str):
+        """条目不再被任何源文件引用时删除"""
+        if any(info["key"] == key for info in self.sources.values()):
+            return
+        (self.root / f"{key}.txt").unlink(missing_ok=True)
+
+    def _save_index(self):
+        atomic_write(self.index_file, json.dumps(self.sources, ensure_ascii=False).encode('utf-8'))
@@ -1,9 +1,68 @@
+import copy
+import itertools
 import json
+import os
+import threading
 import time
 from dataclasses import dataclass
 from enum import Enum
+from pathlib import Path
 
 from core.Project import Project
+from core.token import TokenCounter, MESSAGE_OVERHEAD
+from util.storage import atomic_write
+
+# system消息改写为user消息时添加的说明
+SYSTEM_PREFIX = "[系统消息] !该内容由系统根据流程生成! "
+SYSTEM_SUFFIX = "[系统消息结束]"
+
+
+def system_as_user(message: dict) -> dict:
+    """将system消息改写为user消息，返回新的字典，不修改原消息"""
+    return {"role": "user", "content": SYSTEM_PREFIX + message['content'] + SYSTEM_SUFFIX, "system": True}
+
+
+# 超出token预算时插入的省略说明
+OMITTED_NOTICE = {
+    "file": "[系统消息] 为适应上下文窗口，省略了{}个参考文件",
+    "code": "[系统消息] 为适应上下文窗口，省略了{}个代码空间文件",
+    "conversation": "[系统消息] 为适应上下文窗口，省略了{}条较早的对话",
+    "retrieval": "[系统消息] 为适应上下文窗口，省略了{}个参考文献片段",
+}
+
+
+def _relative_source(source: str) -> str:
+    """来源路径在项目目录下时保存为相对项目目录的路径，与启动时的工作目录无关；否则保存为绝对路径"""
+    path = Path(source).resolve()
+    if Project.instance is not None:
+        try:
+            return path.relative_to(Project.instance.root_path.resolve()).as_posix()
+        except ValueError:
+            pass
+    return str(path)
+
+
+def _resolve_source(source: str) -> Path:
+    """由保存的来源路径得到文件路径，相对路径以项目目录为基准"""
+    path = Path(source)
+    if path.is_absolute() or Project.instance is None:
+        return path
+    return Project.instance.root_path / path
+
+
+def _read_journal(path) -> tuple[list[dict], bool]:
+    """读取日志，忽略崩溃时未写完的记录。第二个返回值表示日志是否存在损坏的记录"""
+    records = []
+    torn = False
+    if not path.exists():
+        return records, torn
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                torn = True
+    return records, torn
 
 
 class MessageRole(Enum):
@@ -27,16 +86,50 @@ class Message:
     # for_user: str
     # think: str
     # tags: list[str] = None
+    # source: str = None  由文件生成的消息记录其来源路径
+    # digest: str = None  来源文件的内容哈希
 
-    def __init__(self,role, for_model, for_user, think="", tags=None):
+    def __init__(self,role, for_model, for_user, think="", tags=None, source=None, digest=None):
         self.tags = tags
         self.role = role
         self.for_model = for_model
         self.for_user = for_user
         self.think = think
+        self.source = source
+        self.digest = digest
         if self.tags is None:
             self.tags = []
 
+    @property
+    def for_model(self) -> str:
+        return self._for_model
+
+    @for_model.setter
+    def for_model(self, value: str):
+        # 内容修改后缓存的token数与发送格式失效
+        self._for_model = value
+        self._tokens = None
+        self._wire = None
+
+    def wire(self) -> dict:
+        """
+        发送给模型的格式，内容不变时返回同一个字典
+        返回的字典会被多轮请求共享，调用方不能修改
+        """
+        if self._wire is None:
+            self._wire = {
+                "role": self.role.value if isinstance(self.role.value, str) else self.role.value[0],
+                "content": self._for_model
+            }
+        return self._wire
+
+    @property
+    def tokens(self) -> int:
+        """发送给模型的内容的token数，按内容与分词器缓存"""
+        if self._tokens is None or self._tokens[0] != TokenCounter.generation:
+            self._tokens = (TokenCounter.generation, TokenCounter.count(self._for_model) + MESSAGE_OVERHEAD)
+        return self._tokens[1]
+
     def __dict__(self):
         return {
             "role": self.role.value if isinstance(self.role.value, str) else self.role.value[0],
@@ -44,47 +137,173 @@ class Message:
             "for_user": self.for_user,
             "think": self.think,
             "tags": self.tags,
+            "source": self.source,
+        }
+
+    def to_record(self) -> dict:
+        """
+        转换为保存用的记录
+        由文件生成的消息每轮都会重新读取，只保存来源路径与内容哈希，加载时从提取缓存重建
+        检索出的参考文献片段无法由来源路径重建，与对话一样保存完整内容
+        """
+        if self.source is None or History.segment_of(self.tags) in ("conversation", "retrieval"):
+            return self.__dict__()
+        return {
+            "role": self.role.value if isinstance(self.role.value, str) else self.role.value[0],
+            "for_user": self.for_user,
+            "tags": self.tags,
+            "source": _relative_source(self.source),
+            "digest": self.digest,
         }
 
     @staticmethod
     def from_dict(data: dict):
-        return Message(MessageRole.from_role(data["role"]), data["for_model"], data["for_user"], data["think"], data["tags"])
+        return Message(MessageRole.from_role(data["role"]), data["for_model"], data["for_user"], data["think"],
+                       data["tags"], data.get("source"))
+
+    @staticmethod
+    def from_record(data: dict):
+        """
+        从保存的记录恢复消息，由ContextAssembler按来源路径重建，未变化的文件直接读取提取缓存
+        来源文件已修改时得到当前内容，与加载后主循环重新读取文件的结果一致；文件已不存在或无法读取时返回None
+        """
+        if "for_model" in data:
+            return Message.from_dict(data)
+        from core.context import ContextAssembler
+        try:
+            return ContextAssembler.get_instance().build(History.segment_of(data["tags"]),
+                                                         _resolve_source(data["source"]))
+        except Exception:
+            return None
 
 class History:
     MAIN_HISTORY = None
+    # 消息分段，发送给模型时按此顺序拼接。除对话外的分段由文件生成，与同名标签对应
+    # retrieval为按最近对话检索出的参考文献片段，每轮都可能变化，放在对话之后以免破坏服务商的前缀缓存
+    SEGMENTS = ("prompt", "tool", "file", "code", "conversation", "retrieval")
+    # 超出token预算时依次省略的分段，提示词与工具说明始终保留
+    DROP_ORDER = ("file", "retrieval", "conversation", "code")
+    KEEP_RECENT = 4  # 省略对话时至少保留的最近消息数
 
     def __init__(self, history: list[Message] = None, name: str = None, tool_settings: dict[str, bool] = None,
                  prompt_settings: dict[str, bool] = None):
-        if history is None:
-            self.history: list[Message] = []
+        self.segments: dict[str, list[Message]] = {segment: [] for segment in History.SEGMENTS}
+        self.versions: dict[str, int] = {segment: 0 for segment in History.SEGMENTS}  # 分段被替换或修改的次数
+        self._wire: dict[str, tuple[int, list[dict]]] = {}  # 分段 -> (版本, 发送格式)
+        self._journal_lock = threading.Lock()
+        self._compactor: threading.Thread = None
+        self._reset_journal()
+        if history is not None:
+            self.history = history
+        self.name = name
         if name is None:
             self.name = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+        self.tool_settings = tool_settings
         if tool_settings is None:
             self.tool_settings = {}
+        self.prompt_settings = prompt_settings
         if prompt_settings is None:
             self.prompt_settings = {}
 
+    @property
+    def history(self) -> list[Message]:
+        """按分段顺序拼接的全部消息"""
+        return list(self.messages())
+
+    @history.setter
+    def history(self, messages: list[Message]):
+        for segment in self.segments.values():
+            segment.clear()
+        for msg in messages:
+            self.segments[History.segment_of(msg.tags)].append(msg)
+        for segment in History.SEGMENTS:
+            self.versions[segment] += 1
+        # 对话不再是只追加的，下次保存时重写快照
+        self._rewrite = True
+
+    @staticmethod
+    def segment_of(tags) -> str:
+        """根据标签判断消息所属的分段"""
+        for tag in tags:
+            if tag in History.SEGMENTS:
+                return tag
+        return "conversation"
+
+    def messages(self):
+        """按分段顺序惰性遍历全部消息"""
+        return itertools.chain.from_iterable(self.segments[segment] for segment in History.SEGMENTS)
 
     def clear(self):
         self.history = []
         self.name = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
         self.prompt_settings = {}
         self.tool_settings = {}
+        self._reset_journal()
 
-    def to_message(self)->list[dict]:
-        """转换成发送给模型的消息"""
-        message = []
-        for msg in self.history:
-            message.append({
-                "role": msg.role.value if isinstance(msg.role.value, str) else msg.role.value[0],
-                "content": msg.for_model
-            })
-        return message
+    def to_message(self, budget: int = -1)->list[dict]:
+        """
+        转换成发送给模型的消息
+        :param budget: token预算，超出时按DROP_ORDER省略低优先级的消息。为-1时不限制
+        """
+        if 0 <= budget < self.token_count():
+            return [msg.wire() for msg in self.fit(budget)]
+        return list(itertools.chain.from_iterable(self._wire_segment(segment) for segment in History.SEGMENTS))
+
+    def _wire_segment(self, segment: str) -> list[dict]:
+        """
+        分段的发送格式缓存
+        分段被替换或修改后重建，对话分段只追加新消息
+        """
+        messages = self.segments[segment]
+        cached = self._wire.get(segment)
+        if cached is None or cached[0] != self.versions[segment] or len(cached[1]) > len(messages):
+            cached = (self.versions[segment], [msg.wire() for msg in messages])
+            self._wire[segment] = cached
+        elif len(cached[1]) < len(messages):
+            cached[1].extend(msg.wire() for msg in messages[len(cached[1]):])
+        return cached[1]
+
+    def token_count(self) -> int:
+        """全部消息的token数"""
+        return sum(msg.tokens for msg in self.messages())
+
+    def fit(self, budget: int) -> list[Message]:
+        """
+        选出不超过token预算的消息
+        参考文件从后往前省略，对话从最早的消息开始省略且保留最近KEEP_RECENT条，最后省略代码空间
+        被省略的分段开头会加入一条说明省略数量的系统消息
+        """
+        total = self.token_count()
+        if total <= budget:
+            return list(self.messages())
+
+        dropped = {}  # 分段 -> 被省略消息的id集合
+        for segment in History.DROP_ORDER:
+            if segment == "conversation":
+                candidates = self.segments[segment][:-History.KEEP_RECENT]
+            else:
+                candidates = reversed(self.segments[segment])
+            dropped[segment] = set()
+            for msg in candidates:
+                if total <= budget:
+                    break
+                dropped[segment].add(id(msg))
+                total -= msg.tokens
+
+        messages = []
+        for segment in History.SEGMENTS:
+            ids = dropped.get(segment)
+            if not ids:
+                messages.extend(self.segments[segment])
+                continue
+            messages.append(Message(MessageRole.SYSTEM, OMITTED_NOTICE[segment].format(len(ids)), ""))
+            messages.extend(msg for msg in self.segments[segment] if id(msg) not in ids)
+        return messages
 
     def to_user(self)->list[dict]:
         """转换成发送给用户的消息"""
         message = []
-        for msg in self.history:
+        for msg in self.messages():
             message.append({
                 "role": msg.role.value if isinstance(msg.role.value, str) else msg.role.value[0],
                 "content": msg.for_user
@@ -95,29 +314,190 @@ class History:
         """添加一条消息"""
         if tags is None:
             tags = []
-        self.history.append(Message(role, for_model, for_user, think, tags))
+        segment = History.segment_of(tags)
+        self.segments[segment].append(Message(role, for_model, for_user, think, tags))
+        if segment != "conversation":
+            self.versions[segment] += 1
 
     def add_message_head(self, role: MessageRole, for_model: str, for_user: str, think: str = "", tags = None):
-        """添加一条消息"""
+        """在消息所属分段的开头添加一条消息"""
         if tags is None:
             tags = []
-        self.history.insert(0, Message(role, for_model, for_user, think, tags))
+        segment = History.segment_of(tags)
+        self.segments[segment].insert(0, Message(role, for_model, for_user, think, tags))
+        self.versions[segment] += 1
+        if segment == "conversation":
+            self._rewrite = True
 
-    def save(self):
-        """保存对话记录"""
-        if self.history is None:
+    def splice(self, tag: str, messages: list[Message]):
+        """
+        用messages替换tag对应分段的全部消息，开销只与该分段的大小有关
+        来源与顺序不变时原地更新消息内容，不替换分段列表
+        """
+        old = self.segments[tag]
+        if [msg.source for msg in old] == [msg.source for msg in messages]:
+            for old_msg, new_msg in zip(old, messages):
+                if old_msg.for_model is not new_msg.for_model:
+                    old_msg.for_model = new_msg.for_model
+                    old_msg.for_user = new_msg.for_user
+                    old_msg.digest = new_msg.digest
+                    self.versions[tag] += 1
             return
+        self.segments[tag] = list(messages)
+        self.versions[tag] += 1
 
-        json_file = Project.instance.root_path / "history" / f"{self.name}.json"
-        if not json_file.parent.exists():
-            json_file.parent.mkdir(parents=True)
+    # ----------------------
+    # 持久化：快照 <名称>.json + 只追加的日志 <名称>.jsonl
+    # ----------------------
+    COMPACT_RECORDS = 200  # 日志记录数超过此值时压缩为快照
+    COMPACT_BYTES = 8 * 1024 * 1024  # 日志大小超过此值时压缩为快照
+
+    @staticmethod
+    def snapshot_file(name: str):
+        return Project.instance.root_path / "history" / f"{name}.json"
+
+    @staticmethod
+    def journal_file(name: str):
+        return Project.instance.root_path / "history" / f"{name}.jsonl"
+
+    def _reset_journal(self):
+        """重置保存状态，下次保存时写入完整快照"""
+        self._seq = 0  # 已写入的最后一条日志序号
+        self._saved_count = 0  # 已保存的对话消息数
+        self._saved_versions: dict[str, int] = {}
+        self._saved_settings = None
+        self._journal_records = 0  # 快照之后的日志记录数
+        self._rewrite = True
+
+    def _mark_saved(self):
+        self._saved_count = len(self.segments["conversation"])
+        self._saved_versions = dict(self.versions)
+        self._saved_settings = json.dumps([self.prompt_settings, self.tool_settings], ensure_ascii=False)
+
+    def _snapshot(self) -> dict:
         to_save = {}
-        to_save['messages'] = [msg.__dict__() for msg in self.history]
+        to_save['messages'] = [msg.to_record() for msg in self.messages()]
         # 添加提示词与工具设置
         to_save['prompt_settings'] = self.prompt_settings
         to_save['tool_settings'] = self.tool_settings
-        with json_file.open('w', encoding='utf-8') as f:
-            f.write(json.dumps(to_save, ensure_ascii=False, indent=2))
+        # 快照已包含的最后一条日志序号
+        to_save['journal_seq'] = self._seq
+        return to_save
+
+    def _pending_records(self) -> list[dict]:
+        """收集上次保存后的变化"""
+        records = []
+        for segment in History.SEGMENTS:
+            if segment == "conversation":
+                continue
+            if self.versions[segment] != self._saved_versions.get(segment):
+                records.append({"op": "segment", "segment": segment,
+                                "messages": [msg.to_record() for msg in self.segments[segment]]})
+        for msg in self.segments["conversation"][self._saved_count:]:
+            records.append({"op": "add", "message": msg.to_record()})
+        settings = json.dumps([self.prompt_settings, self.tool_settings], ensure_ascii=False)
+        if settings != self._saved_settings:
+            records.append({"op": "settings", "prompt_settings": self.prompt_settings,
+                            "tool_settings": self.tool_settings})
+        return records
+
+    def save(self):
+        """
+        保存对话记录
+        只把上次保存后的变化追加到日志，日志过长时在后台压缩为快照
+        """
+        json_file = History.snapshot_file(self.name)
+        if not json_file.parent.exists():
+            json_file.parent.mkdir(parents=True)
+
+        if self._rewrite or not json_file.exists():
+            # 等待进行中的压缩结束，避免旧快照覆盖新写入的快照
+            if self._compactor is not None:
+                self._compactor.join()
+            with self._journal_lock:
+                atomic_write(json_file, json.dumps(self._snapshot(), ensure_ascii=False))
+                History.journal_file(self.name).unlink(missing_ok=True)
+                self._journal_records = 0
+            self._rewrite = False
+            self._mark_saved()
+            HistoryIndex.update(self)
+            return
+
+        records = self._pending_records()
+        if len(records) == 0:
+            return
+        lines = []
+        for record in records:
+            self._seq += 1
+            record["seq"] = self._seq
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        journal = History.journal_file(self.name)
+        with self._journal_lock:
+            with journal.open('a', encoding='utf-8') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_records += len(records)
+            journal_size = journal.stat().st_size
+        self._mark_saved()
+        HistoryIndex.update(self)
+
+        if self._journal_records >= History.COMPACT_RECORDS or journal_size >= History.COMPACT_BYTES:
+            self.compact()
+
+    def compact(self, background: bool = True):
+        """将当前状态写入快照，并从日志中移除快照已包含的记录"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        # 在当前线程收集快照数据并深拷贝，后台线程只负责序列化与写入，期间修改设置不影响快照
+        snapshot = copy.deepcopy(self._snapshot())
+        json_file = History.snapshot_file(self.name)
+        journal = History.journal_file(self.name)
+
+        def _compact():
+            data = json.dumps(snapshot, ensure_ascii=False)
+            with self._journal_lock:
+                atomic_write(json_file, data)
+                # 保留压缩期间新追加的日志
+                remaining = [record for record in _read_journal(journal)[0]
+                             if record["seq"] > snapshot["journal_seq"]]
+                atomic_write(journal, "".join(json.dumps(record, ensure_ascii=False) + "\n"
+                                               for record in remaining))
+                self._journal_records = len(remaining)
+
+        if background:
+            self._compactor = threading.Thread(target=_compact, daemon=True)
+            self._compactor.start()
+        else:
+            _compact()
+
+    def rename(self, new_name: str):
+        """重命名对话记录，快照与日志一同移动"""
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._journal_lock:
+            for old, new in ((History.snapshot_file(self.name), History.snapshot_file(new_name)),
+                             (History.journal_file(self.name), History.journal_file(new_name))):
+                if old.exists():
+                    old.rename(new)
+        HistoryIndex.remove(self.name)
+        self.name = new_name
+        self.save()
+        HistoryIndex.update(self)
+
+    def _apply(self, record: dict):
+        """重放一条日志记录"""
+        if record["op"] == "add":
+            msg = Message.from_record(record["message"])
+            if msg is not None:
+                self.segments[History.segment_of(msg.tags)].append(msg)
+        elif record["op"] == "segment":
+            messages = [Message.from_record(msg) for msg in record["messages"]]
+            self.segments[record["segment"]] = [msg for msg in messages if msg is not None]
+            self.versions[record["segment"]] += 1
+        elif record["op"] == "settings":
+            self.prompt_settings = record["prompt_settings"]
+            self.tool_settings = record["tool_settings"]
 
     @staticmethod
     def get_or_create():
@@ -129,8 +509,8 @@ class History:
 
     @staticmethod
     def load(name: str):
-        """加载对话记录"""
-        json_file = Project.instance.root_path / "history" / f"{name}.json"
+        """加载对话记录：读取快照后重放日志"""
+        json_file = History.snapshot_file(name)
         if not json_file.exists():
             print("文件不存在")
             return History.get_or_create()
@@ -141,6 +521,7 @@ class History:
         history.clear()
 
         # 如果只有一条消息，可能是之前的格式
+        seq = 0
         if isinstance(content, list):
             messages = content
         else:
@@ -149,13 +530,111 @@ class History:
             tool_settings = content.get('tool_settings', {})
             history.prompt_settings = prompt_settings
             history.tool_settings = tool_settings
+            seq = content.get('journal_seq', 0)
 
         for msg in messages:
-            history.add_message(MessageRole.from_role(msg["role"]), msg["for_model"], msg["for_user"], msg["think"], msg["tags"])
+            msg = Message.from_record(msg)
+            if msg is not None:
+                history.segments[History.segment_of(msg.tags)].append(msg)
+
+        records, torn = _read_journal(History.journal_file(name))
+        records = [record for record in records if record["seq"] > seq]
+        for record in records:
+            history._apply(record)
         history.name = name
 
+        for segment in History.SEGMENTS:
+            history.versions[segment] += 1
+        history._seq = max([seq] + [record["seq"] for record in records])
+        history._journal_records = len(records)
+        # 日志末尾有损坏的记录时，下次保存重写快照，避免新记录接在损坏的行后面
+        history._rewrite = torn
+        history._mark_saved()
         return history
 
+class HistoryIndex:
+    """
+    对话列表的元数据索引 history/index.json: {对话名: {"title", "messages", "mtime", "size"}}
+    由History.save维护，列出对话时不需要打开每个对话文件
+    索引按项目缓存在内存中，每次保存只更新一条记录后整体写回
+    """
+    instances: dict[str, 'HistoryIndex'] = {}
+    FILE = "index.json"
+    TITLE_CHARS = 30
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.path = directory / HistoryIndex.FILE
+        try:
+            self.entries: dict[str, dict] = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError):
+            self.entries = {}
+
+    @classmethod
+    def get_instance(cls) -> 'HistoryIndex':
+        """当前项目的索引"""
+        key = str(Project.instance.root_path.resolve())
+        if key not in cls.instances:
+            cls.instances[key] = cls(Project.instance.root_path / "history")
+        return cls.instances[key]
+
+    @staticmethod
+    def title(history: History) -> str:
+        """第一条用户消息的第一行，没有用户消息时使用对话名"""
+        for msg in history.segments["conversation"]:
+            if msg.role == MessageRole.USER and msg.for_user.strip():
+                line = msg.for_user.strip().splitlines()[0]
+                return line if len(line) <= HistoryIndex.TITLE_CHARS else line[:HistoryIndex.TITLE_CHARS] + "…"
+        return history.name
+
+    @classmethod
+    def update(cls, history: History):
+        if Project.instance is None:
+            return
+        index = cls.get_instance()
+        size = 0
+        for file in (History.snapshot_file(history.name), History.journal_file(history.name)):
+            try:
+                size += file.stat().st_size
+            except FileNotFoundError:
+                pass
+        index.entries[history.name] = {"title": cls.title(history),
+                                       "messages": len(history.segments["conversation"]),
+                                       "mtime": time.time(), "size": size}
+        index._write()
+
+    @classmethod
+    def remove(cls, name: str):
+        if Project.instance is None:
+            return
+        index = cls.get_instance()
+        if index.entries.pop(name, None) is not None:
+            index._write()
+
+    def listing(self) -> dict[str, dict]:
+        """
+        列出全部对话，只读取目录列表，不打开对话文件
+        旧版本保存、不在索引中的对话按文件信息补齐，已删除的对话从索引中移除
+        """
+        names = {file.stem: file for file in self.directory.glob("*.json") if file.name != HistoryIndex.FILE}
+        changed = False
+        for name in [name for name in self.entries if name not in names]:
+            del self.entries[name]
+            changed = True
+        for name, file in names.items():
+            if name not in self.entries:
+                stat = file.stat()
+                self.entries[name] = {"title": name, "messages": None, "mtime": stat.st_mtime, "size": stat.st_size}
+                changed = True
+        if changed:
+            self._write()
+        return self.entries
+
+    def _write(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, json.dumps(self.entries, ensure_ascii=False))
+
+
 def change_main_history(history: History):
     """更改主要历史记录"""
     History.MAIN_HISTORY.save()
@@ -0,0 +1,150 @@
+# 每轮对话的耗时统计
+# 记录上下文组装、请求、工具与保存各阶段的耗时，写入项目目录下的 metrics.jsonl，/stats 命令据此汇总
+import json
+import math
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from core.Project import Project
+from core.token import TokenCounter
+
+
+def percentile(values: list[float], p: float) -> float:
+    """最近秩法计算百分位数，p取0到1"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+class Metrics:
+    """
+    耗时统计
+    一轮对话的各阶段耗时累计在同一条turn记录中，每次模型请求单独生成一条request记录
+    request记录带有所属轮次，子代理在工具执行期间发起的请求也能对应到触发它的轮次
+    """
+    instance = None
+
+    def __init__(self):
+        self.turns: list[dict] = []  # 本次会话的轮次记录
+        self.requests: list[dict] = []  # 本次会话的请求记录
+        self.current: Optional[dict] = None
+        self._turn_id = 0
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def begin_turn(self):
+        self._turn_id += 1
+        self.current = {"type": "turn", "turn": self._turn_id, "time": time.time(), "phases": {}}
+
+    def end_turn(self):
+        if self.current is None:
+            return
+        record, self.current = self.current, None
+        self.turns.append(record)
+        self._write(record)
+
+    @contextmanager
+    def phase(self, name: str):
+        """统计一个阶段的耗时，同一轮中同名阶段的耗时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float):
+        if self.current is None:
+            return
+        phases = self.current["phases"]
+        phases[name] = round(phases.get(name, 0.0) + seconds, 6)
+
+    def record_request(self, record: dict):
+        record = {"type": "request", "turn": self.current["turn"] if self.current else None, "time": time.time(),
+                  **record}
+        self.requests.append(record)
+        self._write(record)
+
+    def summary(self) -> dict:
+        """
+        汇总本次会话的统计
+        返回 {"phases": {阶段: [耗时]}, "requests": {(AI源, 模型): {指标: [数值]}}}
+        """
+        phases: dict[str, list[float]] = {}
+        for turn in self.turns:
+            for name, seconds in turn["phases"].items():
+                phases.setdefault(name, []).append(seconds)
+        requests: dict[tuple[str, str], dict[str, list[float]]] = {}
+        for request in self.requests:
+            if request.get("cached"):
+                # 命中本地响应缓存的请求没有网络耗时，不计入延迟统计
+                continue
+            group = requests.setdefault((request["source"], request["model"]), {})
+            for key in RequestTimer.METRICS:
+                if request.get(key) is not None:
+                    group.setdefault(key, []).append(request[key])
+        return {"phases": phases, "requests": requests}
+
+    @staticmethod
+    def _write(record: dict):
+        if Project.instance is None:
+            return
+        try:
+            with (Project.instance.root_path / "metrics.jsonl").open('a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+
+class RequestTimer:
+    """
+    一次模型请求的计时
+    send: 发出请求到收到响应头的时间
+    ttft: 发出请求到第一个token(包括思考过程)的时间
+    first_content: 发出请求到第一个正式回复token的时间，推理模型会先输出思考过程
+    tokens_per_sec: 第一个token之后的生成速度
+    """
+    METRICS = ("send", "ttft", "first_content", "duration", "tokens_per_sec")
+
+    def __init__(self, source: str, model: str):
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.record: dict = {"source": source, "model": model}
+
+    def _elapsed(self, now: float = None) -> float:
+        return round((now or time.perf_counter()) - self.start, 6)
+
+    def set_source(self, source: str, model: str, hedged: bool = False):
+        """记录实际返回结果的AI源，切换到备用源时调用"""
+        self.record.update(source=source, model=model, hedged=hedged)
+
+    def sent(self):
+        self.record["send"] = self._elapsed()
+
+    def cache_hit(self):
+        """回复来自本地响应缓存，只记录查询耗时"""
+        self.record["cached"] = True
+        self.record["duration"] = self._elapsed()
+        Metrics.get_instance().record_request(self.record)
+
+    def chunk(self, think: str, content: str):
+        if self.first_token is None and (think or content):
+            self.first_token = time.perf_counter()
+            self.record["ttft"] = self._elapsed(self.first_token)
+        if content and "first_content" not in self.record:
+            self.record["first_content"] = self._elapsed()
+
+    def finish(self, usage: Optional[dict], think: str, response: str):
+        """请求结束，usage为服务商返回的用量统计，没有时按输出估算token数"""
+        end = time.perf_counter()
+        self.record["duration"] = self._elapsed(end)
+        if usage is not None:
+            self.record.update(usage)
+        tokens = usage["completion_tokens"] if usage and usage.get("completion_tokens") else \
+            TokenCounter.count(think + response)
+        if self.first_token is not None and end > self.first_token:
+            self.record["tokens_per_sec"] = round(tokens / (end - self.first_token), 2)
+        Metrics.get_instance().record_request(self.record)
@@ -2,12 +2,16 @@ import copy
 from pathlib import Path
 
 from core.SurrogateIO import sio_print, try_create_message
-from core.history import History, Message, MessageRole
+from core.context import ContextAssembler
+from core.history import History
 from tui.message import MsgType
 
+PROMPT_DIR = Path("./resource/prompt/")
+
 
 class Prompt:
     _active_prompt = None
+    _listing = None  # 上次合并时的提示词目录列表
 
     default_prompt = {
         "tools": True,
@@ -18,23 +22,21 @@ class Prompt:
     @staticmethod
     def active_all():
         Prompt._active_prompt = {}
+        Prompt._listing = None
         return Prompt.get_or_create()
 
     @staticmethod
     def get_or_create():
         if Prompt._active_prompt is None:
-            active_prompt = copy.copy(Prompt.default_prompt)
-            if Path("./resource/prompt/").exists():
-                for file in Path("./resource/prompt/").iterdir():
-                    # 如果文件是txt
-                    if file.is_file() and file.suffix == ".txt":
-                        if file.stem not in active_prompt:
-                            active_prompt[file.stem] = True
-            Prompt._active_prompt = active_prompt
-        for file in Path("./resource/prompt/").iterdir():
-            if file.is_file() and file.suffix == ".txt":
-                if file.stem not in Prompt._active_prompt:
+            Prompt._active_prompt = copy.copy(Prompt.default_prompt)
+        # 目录列表未变化时跳过扫描
+        files = ContextAssembler.get_instance().list_files(PROMPT_DIR)
+        if files is not Prompt._listing:
+            for file in files:
+                # 如果文件是txt
+                if file.suffix == ".txt" and file.stem not in Prompt._active_prompt:
                     Prompt._active_prompt[file.stem] = True
+            Prompt._listing = files
         return Prompt._active_prompt
 
     @staticmethod
@@ -46,9 +48,6 @@ class Prompt:
 
     @staticmethod
     def is_active(name: str):
-        if name not in Prompt.get_or_create():
-            if Path(f"./resource/prompt/{name}.txt").exists():
-                Prompt._active_prompt[name] = True
         return Prompt.get_or_create().get(name, False)
 
 
@@ -60,29 +59,22 @@ def reload_prompt(history: History, info = True):
     :param info: 是否显示处理信息
     :return:
     """
-    # for msg in history.history:
-        # if msg.tags is not None and "prompt" in msg.tags:
-        #     history.history.remove(msg)
-
-    history.history = [msg for msg in history.history if "prompt" not in msg.tags]
     if info:
         try_create_message(MsgType.SYSTEM)
         sio_print("清空AI提示词记忆")
 
-    # 遍历 ./resource/prompt/ 文件夹下的所有文件
+    # 遍历 ./resource/prompt/ 文件夹下的所有文件，未变化的文件直接使用缓存
+    assembler = ContextAssembler.get_instance()
     prompt_msg = []
-    if Path("./resource/prompt/").exists():
-        for file in Path("./resource/prompt/").iterdir():
-            # 如果文件是txt
-            if file.is_file() and file.suffix == ".txt":
-                # 如果没启用则跳过
-                if not Prompt.is_active(file.stem):
-                    continue
-                # 使用file.read_file_content(file)读取文件内容
-                prompt = file.read_text(encoding='utf-8')
-                prompt_msg.append(Message(MessageRole.SYSTEM, prompt, f"加载提示词 {file.name}", tags=["prompt"], think=""))
-                if info:
-                    sio_print("加载提示词 " + file.name)
+    for file in assembler.list_files(PROMPT_DIR):
+        # 如果文件是txt
+        if file.suffix == ".txt":
+            # 如果没启用则跳过
+            if not Prompt.is_active(file.stem):
+                continue
+            prompt_msg.append(assembler.build("prompt", file))
+            if info:
+                sio_print("加载提示词 " + file.name)
 
     # 将prompt放到history开头
-    history.history = prompt_msg +history.history
\ No newline at end of file
+    history.splice("prompt", assembler.order(prompt_msg))
@@ -0,0 +1,88 @@
+# 模型响应的本地缓存
+# 总结、调试等子代理经常发送完全相同的消息列表，命中缓存时直接返回上次的结果
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from core.Project import Project
+from util.storage import text_digest
+
+
+class ResponseCache:
+    """
+    项目级的响应缓存，位于 projects/<项目名>/.cache/responses.sqlite
+    以(AI源, 模型, 规范化消息的哈希)为键，超过TTL的条目视为未命中
+    总大小超过MAX_BYTES时按最近使用时间淘汰
+    只有调用方显式开启时才会使用，见 communicate(use_cache=True)
+    """
+    instances: dict[str, 'ResponseCache'] = {}
+    MAX_BYTES = 64 * 1024 * 1024
+    TTL = 7 * 24 * 3600
+
+    def __init__(self, path: Path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, think TEXT, response TEXT, size INTEGER, created REAL, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses(used)")
+        self.db.commit()
+
+    @classmethod
+    def get_instance(cls) -> Optional['ResponseCache']:
+        """获取当前项目的缓存，未选择项目时返回None"""
+        if Project.instance is None:
+            return None
+        root = Project.instance.root_path / ".cache"
+        key = str(root)
+        if key not in cls.instances:
+            root.mkdir(parents=True, exist_ok=True)
+            cls.instances[key] = cls(root / "responses.sqlite")
+        return cls.instances[key]
+
+    @staticmethod
+    def key(source: str, model: str, messages: list[dict]) -> str:
+        """只使用角色与内容计算哈希，消息上的其他字段不影响结果"""
+        normalized = [[msg['role'], msg['content']] for msg in messages]
+        data = json.dumps([source, model, normalized], ensure_ascii=False, separators=(',', ':'))
+        return text_digest(data)
+
+    def get(self, key: str) -> Optional[tuple[str, str]]:
+        """返回(思考过程, 回复)，未命中或已过期时返回None"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT think, response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.TTL:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            return row[0], row[1]
+
+    def put(self, key: str, think: str, response: str):
+        now = time.time()
+        size = len(think.encode('utf-8')) + len(response.encode('utf-8'))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, think, response, size, now, now))
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """删除过期条目，总大小仍超过上限时从最久未使用的条目开始删除"""
+        self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.TTL,))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.MAX_BYTES:
+            return
+        evicted = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY used"):
+            if total <= self.MAX_BYTES:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
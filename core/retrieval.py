@@ -0,0 +1,188 @@
+# 参考文献检索
+# 参考文献较多时不再把全部文件放入上下文，而是按BM25检索与最近对话相关的片段
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from core.Project import Project
+from core.history import History, Message, MessageRole
+from util.storage import text_digest
+
+# 英文单词与数字
+ASCII_WORD = re.compile(r"[a-z0-9_]+")
+# 中日韩文字，按相邻两字切分
+CJK_RUN = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+
+CHUNK_CHARS = 800  # 每个片段的最大字符数
+
+
+def tokenize(text: str) -> list[str]:
+    """分词：英文按单词切分并转为小写，中文按相邻两字切分，单独的汉字保留为一个词"""
+    text = text.lower()
+    tokens = ASCII_WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def split_chunks(text: str) -> list[str]:
+    """按段落切分文本，相邻段落合并到不超过CHUNK_CHARS，超长的段落按长度截断"""
+    chunks = []
+    current = ""
+    for para in text.split("\n"):
+        while len(para) > CHUNK_CHARS:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:CHUNK_CHARS])
+            para = para[CHUNK_CHARS:]
+        if current and len(current) + len(para) + 1 > CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{para}" if current else para
+    chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+@dataclass
+class Chunk:
+    """参考文件中的一个片段"""
+    source: str
+    index: int
+    text: str
+    digest: str
+    terms: Counter = field(repr=False)
+    length: int = 0
+    rendered: str = field(default="", repr=False)  # 发送给模型的内容，同一片段每轮复用同一个字符串
+
+    @property
+    def key(self) -> str:
+        return f"{self.source}#{self.index}"
+
+
+class RetrievalIndex:
+    """
+    项目级的片段倒排索引
+    文件按内容哈希增量更新，只有变化的文件重新切分与分词
+    查询时按词项的倒排表用NumPy批量计算BM25得分
+    """
+    instances: dict[str, 'RetrievalIndex'] = {}
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        self.documents: dict[str, tuple[str, list[Chunk]]] = {}  # 源文件 -> (内容哈希, 片段)
+        self._chunks: list[Chunk] = []
+        self._postings: Optional[dict[str, tuple[np.ndarray, np.ndarray]]] = None  # 词项 -> (片段编号, 词频)
+        self._idf: dict[str, float] = {}
+        self._norm: np.ndarray = np.zeros(0)
+        self._selected: list[Chunk] = []  # 上一次选出的片段
+        self._messages: list[Message] = []  # 上一次选出的片段对应的消息
+
+    @classmethod
+    def get_instance(cls) -> 'RetrievalIndex':
+        """获取当前项目的索引，未选择项目时使用共享的索引"""
+        key = str(Project.instance.root_path) if Project.instance is not None else ""
+        if key not in cls.instances:
+            cls.instances[key] = cls()
+        return cls.instances[key]
+
+    def update(self, source: str, digest: str, text: str) -> bool:
+        """更新一个文件的片段，内容未变化时直接返回False"""
+        document = self.documents.get(source)
+        if document is not None and document[0] == digest:
+            return False
+        chunks = []
+        for i, chunk_text in enumerate(split_chunks(text)):
+            terms = Counter(tokenize(chunk_text))
+            chunk_digest = text_digest(chunk_text)
+            chunks.append(Chunk(source, i, chunk_text, chunk_digest, terms, sum(terms.values()),
+                                f"*参考文献*{Path(source).name} 片段{i + 1}\n{chunk_text}"))
+        self.documents[source] = (digest, chunks)
+        self._postings = None
+        return True
+
+    def retain(self, sources: set[str]):
+        """移除不在sources中的文件"""
+        removed = [source for source in self.documents if source not in sources]
+        for source in removed:
+            del self.documents[source]
+        if removed:
+            self._postings = None
+
+    def _build(self):
+        """由各文件的片段重建倒排表"""
+        self._chunks = [chunk for source in sorted(self.documents) for chunk in self.documents[source][1]]
+        ids: dict[str, list[int]] = {}
+        tfs: dict[str, list[int]] = {}
+        for i, chunk in enumerate(self._chunks):
+            for term, tf in chunk.terms.items():
+                ids.setdefault(term, []).append(i)
+                tfs.setdefault(term, []).append(tf)
+        self._postings = {term: (np.array(ids[term], dtype=np.int32), np.array(tfs[term], dtype=np.float32))
+                          for term in ids}
+
+        n = len(self._chunks)
+        self._idf = {term: float(np.log(1 + (n - len(ids[term]) + 0.5) / (len(ids[term]) + 0.5))) for term in ids}
+        lengths = np.array([chunk.length for chunk in self._chunks], dtype=np.float32)
+        avgdl = float(lengths.mean()) if n and lengths.mean() > 0 else 1.0
+        self._norm = self.K1 * (1 - self.B + self.B * lengths / avgdl)
+
+    def search(self, query: str, top_k: int) -> list[Chunk]:
+        """返回与query最相关的top_k个片段，按得分从高到低排列，没有匹配的词时返回空列表"""
+        if self._postings is None:
+            self._build()
+        terms = sorted(term for term in set(tokenize(query)) if term in self._postings)
+        if not terms or top_k <= 0:
+            return []
+
+        ids = np.concatenate([self._postings[term][0] for term in terms])
+        tf = np.concatenate([self._postings[term][1] for term in terms])
+        idf = np.repeat([self._idf[term] for term in terms], [len(self._postings[term][0]) for term in terms])
+        weights = idf * tf * (self.K1 + 1) / (tf + self._norm[ids])
+        scores = np.bincount(ids, weights=weights, minlength=len(self._chunks))
+
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [self._chunks[i] for i in top]
+
+    def select(self, query: str, top_k: int) -> list[Message]:
+        """
+        检索与query相关的片段并生成retrieval分段的消息，片段按(文件, 片段序号)排列，与得分无关
+        选出的片段与上一次相同时返回同一组消息；没有匹配的片段时沿用上一次仍然有效的片段
+        """
+        chunks = sorted(self.search(query, top_k), key=lambda chunk: (chunk.source, chunk.index))
+        if not chunks:
+            chunks = [chunk for chunk in self._selected if self._current(chunk)]
+        if len(chunks) == len(self._selected) and all(a is b for a, b in zip(chunks, self._selected)):
+            return self._messages
+        self._selected = chunks
+        self._messages = [Message(MessageRole.SYSTEM, chunk.rendered, "", tags=["retrieval"],
+                                  source=chunk.key, digest=chunk.digest) for chunk in chunks]
+        return self._messages
+
+    def _current(self, chunk: Chunk) -> bool:
+        """片段所属的文件仍在索引中且内容未变化"""
+        document = self.documents.get(chunk.source)
+        return document is not None and any(item is chunk for item in document[1])
+
+
+def latest_query(history: History) -> str:
+    """最近一条用户消息及其之后的工具反馈，用作检索的查询"""
+    parts = []
+    for msg in reversed(history.segments["conversation"]):
+        if msg.role != MessageRole.ASSISTANT:
+            parts.append(msg.for_model)
+        if msg.role == MessageRole.USER:
+            break
+    return "\n".join(reversed(parts))
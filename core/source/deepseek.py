@@ -1,8 +1,8 @@
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
 from core.SurrogateIO import sio_print
 from core.cache import Configure
-from core.source.sources import BaseSource, SourceRegistry
+from core.source.sources import BaseSource, SourceRegistry, openai_client, openai_usage
 
 
 @SourceRegistry.register("DeepSeek")
@@ -23,24 +23,43 @@ class SourceOpenAI(BaseSource):
 
     @classmethod
     def create_stream(cls, message: list[dict]) -> Any:
-        configure = Configure.get_instance()
-        api = configure.deepseek_api_key
-        url = "https://api.deepseek.com"
         try:
             from openai import OpenAI
         except ImportError as e:
             sio_print("openai库未安装")
             raise e
-        client = OpenAI(api_key=api, base_url=url)
-        stream = client.chat.completions.create(
-            model=configure.active_model[configure.active_ai],
-            messages=validate_message_structure(message),
-            stream=True
-        )
-        return stream
+        client = openai_client(cls, is_async=False)
+        return client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        try:
+            from openai import AsyncOpenAI
+        except ImportError as e:
+            sio_print("openai库未安装")
+            raise e
+        client = openai_client(cls, is_async=True)
+        return await client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    def _client_args(cls) -> dict:
+        return {"api_key": Configure.get_instance().deepseek_api_key, "base_url": "https://api.deepseek.com"}
+
+    @classmethod
+    def _request(cls, message: list[dict]) -> dict:
+        configure = Configure.get_instance()
+        return {
+            "model": configure.active_model[cls.source_name],
+            "messages": validate_message_structure(message),
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
 
     @classmethod
     def catch_chunk_in_stream(cls, chunk)-> [str, str]:
+        # 末尾的用量统计chunk不包含choices
+        if len(chunk.choices) == 0:
+            return "", ""
         content, think_content = "", ""
         if chunk.choices[0].delta.content is not None:
             content = chunk.choices[0].delta.content
@@ -48,13 +67,17 @@ class SourceOpenAI(BaseSource):
             think_content = chunk.choices[0].delta.model_extra["reasoning_content"]
         return think_content, content
 
+    @classmethod
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        return openai_usage(chunk)
+
 
 def validate_message_structure(messages: list[dict]) -> list[dict]:
     """
     处理消息列表使其符合交替的user-assistant结构
     1. 跳过开头的system消息（确保后续处理不影响初始设置）
     2. 在前一个消息是user的情况下，如果当前还是user则插入空assistant
-    3. 保留原始消息内容不进行修改
+    3. 保留原始消息内容不进行修改，直接引用原消息对象而不复制
 
     示例输入: [{'role':'user'}, {'role':'user'}]
     期望输出: [{'role':'user'}, {'role':'assistant', 'content':''}, {'role':'user'}]
@@ -65,8 +88,8 @@ def validate_message_structure(messages: list[dict]) -> list[dict]:
     processed = [m for m in messages if m['role'] == "system"]
 
     for i in range(len(processed), len(messages)):
-        current = messages[i].copy()
-        prev_role = processed[i-1]['role']
+        current = messages[i]
+        prev_role = processed[-1]['role'] if processed else None
 
         if current['role'] == 'user' and prev_role == 'user':
             processed.append({'role': 'assistant', 'content': ''})
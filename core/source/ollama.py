@@ -1,8 +1,8 @@
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
 from core.SurrogateIO import sio_print
 from core.cache import Configure
-from core.source.sources import BaseSource, SourceRegistry
+from core.source.sources import BaseSource, ClientCache, SourceRegistry
 
 
 @SourceRegistry.register("Ollama")
@@ -32,7 +32,33 @@ class SourceOpenAI(BaseSource):
         )
         return stream
 
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        try:
+            from ollama import AsyncClient
+        except ImportError as e:
+            sio_print("ollama 库未安装")
+            raise e
+        # 客户端在多轮对话之间复用，保持与本地服务的连接
+        client = ClientCache.get(cls.source_name, True, (), AsyncClient)
+        return await client.chat(
+            model=Configure.get_instance().active_model["Ollama"],
+            messages=message,
+            stream=True
+        )
+
     @classmethod
     def catch_chunk_in_stream(cls, chunk)-> [str, str]:
         content = chunk.message.content
-        return "", content
\ No newline at end of file
+        return "", content
+
+    @classmethod
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        # 最后一个chunk带有统计信息，Ollama没有前缀缓存统计
+        if not chunk.done:
+            return None
+        return {
+            "prompt_tokens": chunk.prompt_eval_count,
+            "completion_tokens": chunk.eval_count,
+            "cached_tokens": None,
+        }
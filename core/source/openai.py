@@ -1,12 +1,16 @@
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
 from core.SurrogateIO import sio_print
 from core.cache import Configure
-from core.source.sources import BaseSource, SourceRegistry
+from core.history import system_as_user
+from core.source.sources import BaseSource, SourceRegistry, openai_client, openai_usage
+from util.stage import StageCache
 
 
 @SourceRegistry.register("OpenAI_API")
 class SourceOpenAI(BaseSource):
+    _system_as_user = StageCache(lambda msg: system_as_user(msg) if msg['role'] == 'system' else msg)
+
     @classmethod
     def is_available(cls) -> bool:
         # 检查API
@@ -23,31 +27,50 @@ class SourceOpenAI(BaseSource):
 
     @classmethod
     def create_stream(cls, message: list[dict]) -> Any:
-        # 把所有system都换成user
-        for i in range(len(message)):
-            if message[i]['role'] == 'system':
-                message[i]['role'] = 'user'
-                message[i]['content'] = "[系统消息] !该内容由系统根据流程生成! "+message[i]['content'] + "[系统消息结束]"
-                message[i]['system'] = True
-        configure = Configure.get_instance()
-        api = configure.openai_api_key
-        url = "https://api.openai.com/v1"
         try:
             from openai import OpenAI
         except ImportError as e:
             sio_print("openai库未安装")
             raise e
-        client = OpenAI(api_key=api, base_url=url)
-        stream = client.chat.completions.create(
-            model=configure.active_model[configure.active_ai],
-            messages=message,
-            stream=True
-        )
-        return stream
+        client = openai_client(cls, is_async=False)
+        return client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        try:
+            from openai import AsyncOpenAI
+        except ImportError as e:
+            sio_print("openai库未安装")
+            raise e
+        client = openai_client(cls, is_async=True)
+        return await client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    def _client_args(cls) -> dict:
+        return {"api_key": Configure.get_instance().openai_api_key, "base_url": "https://api.openai.com/v1"}
+
+    @classmethod
+    def _request(cls, message: list[dict]) -> dict:
+        # 把所有system都换成user，改写结果按消息缓存，不修改传入的消息
+        message = cls._system_as_user(message)
+        configure = Configure.get_instance()
+        return {
+            "model": configure.active_model[cls.source_name],
+            "messages": message,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
 
     @classmethod
     def catch_chunk_in_stream(cls, chunk)-> [str, str]:
+        # 末尾的用量统计chunk不包含choices
+        if len(chunk.choices) == 0:
+            return "", ""
         if chunk.choices[0].delta.content is not None:
             content = chunk.choices[0].delta.content
             return "", content
-        return "", ""
\ No newline at end of file
+        return "", ""
+
+    @classmethod
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        return openai_usage(chunk)
@@ -0,0 +1,159 @@
+# 录制与回放AI源
+# 录制模式包装一个真实的AI源，把流式响应连同chunk之间的间隔保存为录像；回放模式按录像重现流式响应
+# 用于在没有网络与API key的环境中端到端运行对话循环、调试器与工具，以及在本地重现线上的慢响应
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
+
+from core.Project import Project
+from core.SurrogateIO import sio_print
+from core.cache import Configure
+from core.source.sources import BaseSource, SourceRegistry, close_stream
+from core.token import TokenCounter
+from util.storage import text_digest
+
+
+def cassette_dir() -> Path:
+    """录像目录，按Replay源的模型名分组，模型名即录像集的名称"""
+    configure = Configure.get_instance()
+    if configure.replay_dir:
+        root = Path(configure.replay_dir)
+    elif Project.instance is not None:
+        root = Project.instance.root_path / "replay"
+    else:
+        root = Path("./replay")
+    return root / configure.active_model.get("Replay", "default")
+
+
+def cassette_key(message: list[dict]) -> str:
+    """只使用角色与内容计算录像的键"""
+    normalized = [[msg['role'], msg['content']] for msg in message]
+    data = json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+    return text_digest(data)
+
+
+@SourceRegistry.register("Replay")
+class SourceReplay(BaseSource):
+    """
+    录像中的chunk为 {"delay": 与上一个chunk的间隔秒数, "think": 思考过程, "content": 回复, "usage": 用量统计或null}
+    回放速度由 replay_speed 控制，为0时不等待；replay_tokens_per_sec 大于0时改为按固定的token速率输出
+    """
+
+    @classmethod
+    def is_available(cls) -> bool:
+        configure = Configure.get_instance()
+        if configure.replay_mode == "record":
+            target = configure.replay_target
+            if target is None or target == cls.source_name or target not in SourceRegistry.sources:
+                sio_print("录制模式需要设置被录制的AI源 replay_target")
+                return False
+            return SourceRegistry.sources[target].is_available()
+        if not cassette_dir().exists():
+            sio_print(f"录像目录 {cassette_dir()} 不存在")
+            return False
+        return True
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        if Configure.get_instance().replay_mode == "record":
+            return cls._record(message)
+        return cls._replay(cls._load(message))
+
+    @classmethod
+    def create_stream(cls, message: list[dict]) -> Iterator:
+        """同步的录制与回放，供总结等同步调用方使用，录像格式与异步流相同"""
+        if Configure.get_instance().replay_mode == "record":
+            return cls._record_sync(message)
+        return cls._replay_sync(cls._load(message))
+
+    @classmethod
+    def _load(cls, message: list[dict]) -> dict:
+        path = cassette_dir() / f"{cassette_key(message)}.json"
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            raise FileNotFoundError(f"没有找到与当前对话对应的录像 {path}")
+
+    @classmethod
+    async def _record(cls, message: list[dict]) -> AsyncIterator:
+        target: BaseSource.__class__ = SourceRegistry.sources[Configure.get_instance().replay_target]
+        stream = await target.create_stream_async(message)
+        chunks = []
+        last = time.perf_counter()
+        try:
+            async for raw in stream:
+                chunk, last = cls._capture(target, raw, last)
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await close_stream(stream)
+            cls._save(target, message, chunks)
+
+    @classmethod
+    def _record_sync(cls, message: list[dict]) -> Iterator:
+        target: BaseSource.__class__ = SourceRegistry.sources[Configure.get_instance().replay_target]
+        stream = target.create_stream(message)
+        chunks = []
+        last = time.perf_counter()
+        try:
+            for raw in stream:
+                chunk, last = cls._capture(target, raw, last)
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            cls._save(target, message, chunks)
+
+    @staticmethod
+    def _capture(target: BaseSource.__class__, raw, last: float) -> tuple[dict, float]:
+        """把被录制AI源的一个chunk转换为录像格式，返回(chunk, 当前时间)"""
+        think, content = target.catch_chunk_in_stream(raw)
+        now = time.perf_counter()
+        return {"delay": round(now - last, 6), "think": think, "content": content,
+                "usage": target.catch_usage_in_stream(raw)}, now
+
+    @staticmethod
+    def _save(target: BaseSource.__class__, message: list[dict], chunks: list[dict]):
+        """保存录像，提前停止的流同样保存，回放时在同一位置结束"""
+        directory = cassette_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        cassette = {"source": target.source_name,
+                    "model": Configure.get_instance().active_model.get(target.source_name), "chunks": chunks}
+        (directory / f"{cassette_key(message)}.json").write_text(
+            json.dumps(cassette, ensure_ascii=False, indent=1), encoding='utf-8')
+
+    @staticmethod
+    def _delay(chunk: dict) -> float:
+        """回放时chunk之前等待的秒数"""
+        configure = Configure.get_instance()
+        if configure.replay_tokens_per_sec > 0:
+            return TokenCounter.count(chunk["think"] + chunk["content"]) / configure.replay_tokens_per_sec
+        if configure.replay_speed > 0:
+            return chunk["delay"] / configure.replay_speed
+        return 0
+
+    @classmethod
+    async def _replay(cls, cassette: dict) -> AsyncIterator:
+        for chunk in cassette["chunks"]:
+            await asyncio.sleep(cls._delay(chunk))
+            yield chunk
+
+    @classmethod
+    def _replay_sync(cls, cassette: dict) -> Iterator:
+        for chunk in cassette["chunks"]:
+            delay = cls._delay(chunk)
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    @classmethod
+    def catch_chunk_in_stream(cls, chunk) -> [str, str]:
+        return chunk["think"], chunk["content"]
+
+    @classmethod
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        return chunk.get("usage")
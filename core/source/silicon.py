@@ -1,8 +1,8 @@
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 
 from core.SurrogateIO import sio_print
 from core.cache import Configure
-from core.source.sources import BaseSource, SourceRegistry
+from core.source.sources import BaseSource, SourceRegistry, openai_client, openai_usage
 
 
 @SourceRegistry.register("SiliconFlow")
@@ -23,27 +23,50 @@ class SourceOpenAI(BaseSource):
 
     @classmethod
     def create_stream(cls, message: list[dict]) -> Any:
-        configure = Configure.get_instance()
-        api = configure.siliconflow_api_key
-        url = "https://api.siliconflow.com/v1"
         try:
             from openai import OpenAI
         except ImportError as e:
             sio_print("openai库未安装")
             raise e
-        client = OpenAI(api_key=api, base_url=url)
-        stream = client.chat.completions.create(
-            model=configure.active_model[configure.active_ai],
-            messages=message,
-            stream=True
-        )
-        return stream
+        client = openai_client(cls, is_async=False)
+        return client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        try:
+            from openai import AsyncOpenAI
+        except ImportError as e:
+            sio_print("openai库未安装")
+            raise e
+        client = openai_client(cls, is_async=True)
+        return await client.chat.completions.create(**cls._request(message))
+
+    @classmethod
+    def _client_args(cls) -> dict:
+        return {"api_key": Configure.get_instance().siliconflow_api_key, "base_url": "https://api.siliconflow.com/v1"}
+
+    @classmethod
+    def _request(cls, message: list[dict]) -> dict:
+        configure = Configure.get_instance()
+        return {
+            "model": configure.active_model[cls.source_name],
+            "messages": message,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
 
     @classmethod
     def catch_chunk_in_stream(cls, chunk)-> [str, str]:
+        # 末尾的用量统计chunk不包含choices
+        if len(chunk.choices) == 0:
+            return "", ""
         content, think_content = "", ""
         if chunk.choices[0].delta.content is not None:
             content = chunk.choices[0].delta.content
         if chunk.choices[0].delta.model_extra["reasoning_content"] is not None:
             think_content = chunk.choices[0].delta.model_extra["reasoning_content"]
-        return think_content, content
\ No newline at end of file
+        return think_content, content
+
+    @classmethod
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        return openai_usage(chunk)
@@ -1,5 +1,11 @@
 import asyncio
-from typing import List, Dict, Any
+import importlib.util
+import inspect
+import threading
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Iterable
+
+from core.cache import Configure
+from util.manifest import LazyRegistry
 
 
 class BaseSource:
@@ -21,19 +27,80 @@ class BaseSource:
         raise NotImplementedError
 
     @classmethod
-    async def create_stream_async(cls, messages):
-        sync_gen = cls.create_stream(messages)  # 获取同步生成器
+    def catch_usage_in_stream(cls, chunk) -> Optional[dict]:
+        """
+        从chunk中获取用量统计，没有用量信息时返回None
+        返回值包含 prompt_tokens, completion_tokens, cached_tokens(命中服务商前缀缓存的token数，未知时为None)
+        """
+        return None
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]) -> AsyncIterator:
+        """
+        将对话发送给AI源，返回异步迭代的流式响应
+        有异步客户端的AI源应覆盖此方法。默认在一个后台线程中迭代create_stream返回的同步流
+        """
+        return iterate_in_thread(lambda: cls.create_stream(message))
+
+
+async def iterate_in_thread(create: Callable[[], Iterable]) -> AsyncIterator:
+    """
+    在一个后台线程中创建并迭代同步流，数据通过队列交给事件循环，不阻塞事件循环
+    消费方提前停止时通知线程关闭同步流
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭
+            stopped.set()
+
+    def produce():
+        stream = None
+        try:
+            stream = create()
+            for chunk in stream:
+                if stopped.is_set():
+                    break
+                put((chunk, None))
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+        finally:
+            close = getattr(stream, "close", None)
+            if stopped.is_set() and close is not None:
+                close()
+
+    threading.Thread(target=produce, daemon=True, name="stream-reader").start()
+    try:
         while True:
-            try:
-                # 将 next() 放到线程池执行，避免阻塞事件循环
-                chunk = await asyncio.to_thread(next, sync_gen)
-                yield chunk
-            except StopIteration:
-                break
+            chunk, error = await queue.get()
+            if chunk is done:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        stopped.set()
+
+
+async def close_stream(stream):
+    """关闭流式响应，兼容异步生成器、openai的AsyncStream与同步流"""
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is None:
+        return
+    result = close()
+    if asyncio.iscoroutine(result):
+        await result
 
 
 class SourceRegistry:
-    sources: Dict[str, BaseSource.__class__] = {}
+    sources: LazyRegistry = LazyRegistry()  # AI源名称 -> AI源类，取用时才导入实现模块
 
     @classmethod
     def register(cls, source_name: str):
@@ -42,4 +109,192 @@ class SourceRegistry:
             cls.sources[source_name] = source_class
             source_class.source_name = source_name
             return source_class
-        return decorator
\ No newline at end of file
+        return decorator
+
+    @classmethod
+    async def open_stream(cls, message: list[dict], on_sent: Optional[Callable[[], None]] = None) \
+            -> tuple[BaseSource.__class__, AsyncIterator, bool]:
+        """
+        向当前AI源发送请求，返回(实际使用的AI源, 流式响应, 是否切换到了备用源)
+        配置了备用源时，主AI源在hedge_after秒内没有输出任何token，或者请求失败，就同时向备用源发送请求
+        先输出token的一方胜出，另一方的请求被取消
+        on_sent在主AI源的请求发出并收到响应头时调用，等待首token之前
+        """
+        configure = Configure.get_instance()
+        primary = cls.sources[configure.active_ai]
+        fallback_name = configure.fallback_ai
+        if (fallback_name is None or fallback_name == configure.active_ai or fallback_name not in cls.sources
+                or fallback_name not in configure.active_model or configure.hedge_after < 0):
+            stream = await primary.create_stream_async(message)
+            if on_sent is not None:
+                on_sent()
+            return primary, stream, False
+
+        tasks = {asyncio.create_task(_first_token(primary, message, on_sent)): primary}
+        done, _ = await asyncio.wait(set(tasks), timeout=configure.hedge_after)
+        if done and not next(iter(done)).exception():
+            return primary, _replay(next(iter(done)).result()), False
+
+        fallback = cls.sources[fallback_name]
+        if not fallback.is_available():
+            # 备用源不可用时继续等待主AI源
+            return primary, _replay(await next(iter(tasks))), False
+        tasks[asyncio.create_task(_first_token(fallback, message))] = fallback
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                if pending:
+                    await asyncio.wait(pending)
+                return tasks[task], _replay(task.result()), tasks[task] is fallback
+        raise error
+
+
+async def _first_token(source_cls: BaseSource.__class__, message: list[dict],
+                       on_sent: Optional[Callable[[], None]] = None) -> tuple:
+    """
+    发送请求并读取到第一个token为止，返回(AI源, 流, 迭代器, 已读取的chunk, 是否已结束)
+    on_sent在请求发出后、读取第一个token前调用。被取消或出错时关闭流
+    """
+    stream = await source_cls.create_stream_async(message)
+    if on_sent is not None:
+        on_sent()
+    iterator = aiter(stream)
+    buffered = []
+    try:
+        while True:
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return source_cls, stream, iterator, buffered, True
+            buffered.append(chunk)
+            think, content = source_cls.catch_chunk_in_stream(chunk)
+            if think or content:
+                return source_cls, stream, iterator, buffered, False
+    except BaseException:
+        await close_stream(stream)
+        raise
+
+
+async def _replay(first: tuple) -> AsyncIterator:
+    """先返回已读取的chunk，再继续读取剩余的流，结束或被关闭时关闭原始的流"""
+    _, stream, iterator, buffered, finished = first
+    try:
+        for chunk in buffered:
+            yield chunk
+        if not finished:
+            async for chunk in iterator:
+                yield chunk
+    finally:
+        await close_stream(stream)
+
+
+class ClientCache:
+    """
+    按AI源缓存长期使用的客户端，连接在多轮对话、总结与调试器之间复用，避免每次请求重新握手
+    客户端以(API key, 地址, 连接池配置)为键，配置变化时重新创建
+    异步客户端的连接与事件循环绑定，事件循环变化时同样重新创建
+    被替换的客户端随即关闭，释放其连接池
+    """
+    clients: dict[tuple[str, bool], tuple[tuple, Any]] = {}  # (AI源, 是否异步) -> (键, 客户端)
+    _closing: set[asyncio.Task] = set()  # 正在关闭的异步客户端，保留引用直到关闭完成
+
+    @classmethod
+    def get(cls, source_name: str, is_async: bool, key: tuple, factory: Callable[[], Any]) -> Any:
+        if is_async:
+            key = key + (id(asyncio.get_running_loop()),)
+        cached = cls.clients.get((source_name, is_async))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        client = factory()
+        cls.clients[(source_name, is_async)] = (key, client)
+        if cached is not None:
+            cls._close(cached[1])
+        return client
+
+    @classmethod
+    def _close(cls, client: Any):
+        """
+        关闭被替换的客户端，异常被忽略
+        异步客户端的关闭协程在当前事件循环中执行，原事件循环已关闭时连接随之失效，关闭失败不影响新客户端
+        """
+        close = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if close is None:
+            return
+        try:
+            result = close()
+        except Exception:
+            return
+        if not inspect.isawaitable(result):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if inspect.iscoroutine(result):
+                result.close()
+            return
+        task = loop.create_task(cls._await_close(result))
+        cls._closing.add(task)
+        task.add_done_callback(cls._closing.discard)
+
+    @staticmethod
+    async def _await_close(result):
+        try:
+            await result
+        except Exception:
+            pass
+
+
+def pool_limits() -> tuple[int, int, float]:
+    """连接池配置: (最大连接数, 最大保持连接数, 空闲连接保持秒数)"""
+    configure = Configure.get_instance()
+    return configure.http_max_connections, configure.http_max_keepalive, configure.http_keepalive_expiry
+
+
+def http2_available() -> bool:
+    """httpx需要安装h2才能使用HTTP/2"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def openai_client(source: BaseSource.__class__, is_async: bool) -> Any:
+    """获取AI源缓存的OpenAI兼容客户端，source需要提供_client_args返回api_key与base_url"""
+    args = source._client_args()
+    limits = pool_limits()
+
+    def create():
+        import httpx
+        import openai
+        http_client_cls = openai.DefaultAsyncHttpxClient if is_async else openai.DefaultHttpxClient
+        http_client = http_client_cls(
+            http2=http2_available(),
+            limits=httpx.Limits(max_connections=limits[0], max_keepalive_connections=limits[1],
+                                keepalive_expiry=limits[2])
+        )
+        client_cls = openai.AsyncOpenAI if is_async else openai.OpenAI
+        return client_cls(**args, http_client=http_client)
+
+    return ClientCache.get(source.source_name, is_async, (args["api_key"], args["base_url"], limits), create)
+
+
+def openai_usage(chunk) -> Optional[dict]:
+    """解析OpenAI兼容接口在流末尾返回的用量统计"""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        return None
+    # DeepSeek 使用 prompt_cache_hit_tokens，OpenAI 使用 prompt_tokens_details.cached_tokens
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": cached,
+    }
@@ -56,13 +56,21 @@ class InitStateManager:
     def __init__(self):
         self.condition = asyncio.Condition()
         self.state = InitStateManager.InitState.STARTING
+        self.progress: tuple[str, int, int] = ("", 0, 0)  # 当前阶段的进度: (文件名, 已完成数, 总数)
 
     async def set_state(self, new_state: InitState):
         async with self.condition:
             self.state = new_state
+            self.progress = ("", 0, 0)
             print(f"状态变更: {new_state}")
             self.condition.notify_all()  # 唤醒所有等待的任务
 
+    async def report_progress(self, name: str, done: int, total: int):
+        """报告当前阶段中单个文件的加载进度"""
+        async with self.condition:
+            self.progress = (name, done, total)
+            self.condition.notify_all()
+
     async def wait_for_state(self, expected_state: InitState):
         async with self.condition:
             await self.condition.wait_for(lambda: self.state == expected_state)
@@ -0,0 +1,51 @@
+# 令牌计数
+# 默认使用按字符类别估算的方式，可以通过TokenCounter.set_tokenizer替换为精确的分词器
+import re
+from typing import Callable, Optional
+
+from util.stage import StageCache
+
+# 中日韩文字与全角标点
+CJK_PATTERN = re.compile('[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+# 估算系数参考DeepSeek的说明：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_RATIO = 0.6
+OTHER_RATIO = 0.3
+MESSAGE_OVERHEAD = 4  # 每条消息的角色与分隔符开销
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符类别估算token数，中文按字计算，其他字符按长度折算"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return int(cjk * CJK_RATIO + (len(text) - cjk) * OTHER_RATIO) + 1
+
+
+class TokenCounter:
+    """
+    token计数器
+    tokenizer为接收文本、返回token数的函数，为None时使用估算
+    替换分词器后generation递增，消息上缓存的计数随之失效
+    """
+    tokenizer: Optional[Callable[[str], int]] = None
+    generation = 0
+    # 每条消息的计数按消息对象缓存
+    _message_counts = StageCache(lambda msg: TokenCounter.count(msg['content']) + MESSAGE_OVERHEAD)
+
+    @classmethod
+    def set_tokenizer(cls, tokenizer: Optional[Callable[[str], int]]):
+        cls.tokenizer = tokenizer
+        cls.generation += 1
+        cls._message_counts.clear()
+
+    @classmethod
+    def count(cls, text: str) -> int:
+        if cls.tokenizer is None:
+            return estimate_tokens(text)
+        return cls.tokenizer(text)
+
+    @classmethod
+    def count_messages(cls, messages: list[dict]) -> int:
+        """计算发送给模型的消息列表的token数，未变化的消息使用缓存的计数"""
+        return sum(cls._message_counts(messages))
@@ -0,0 +1,219 @@
+# 目录监视
+# Linux上通过ctypes调用libc的inotify，文件变化时由事件循环直接回调，不需要定时唤醒
+# 其他平台或inotify不可用时退回到轮询，比较文件的修改时间与大小快照
+# 只报告目录下一层的文件，不递归子目录
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+
+@dataclass(frozen=True)
+class FileEvent:
+    """
+    单个文件的变化
+    kind: add新增 / remove删除 / modify修改 / rescan事件丢失，需要重新扫描path目录
+    """
+    kind: str
+    path: Path
+
+
+def coalesce(events: Iterable[FileEvent]) -> list[FileEvent]:
+    """合并同一批次中同一文件的多个事件，例如新增后写入只报告新增，新增后删除的临时文件不报告"""
+    merged: dict[Path, str] = {}
+    for event in events:
+        previous = merged.get(event.path)
+        kind = event.kind
+        if previous == "add" and kind == "modify":
+            kind = "add"
+        elif previous == "add" and kind == "remove":
+            merged.pop(event.path)
+            continue
+        elif previous == "remove" and kind == "add":
+            kind = "modify"
+        merged[event.path] = kind
+    return [FileEvent(kind, path) for path, kind in merged.items()]
+
+
+def snapshot(directory: Path) -> dict[Path, tuple[int, int]]:
+    """目录下文件的(修改时间, 大小)快照，目录不存在时为空"""
+    result = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        result[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return result
+
+
+class _Inotify:
+    """libc的inotify接口"""
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+
+    def watch(self, directory: Path) -> int:
+        wd = self.add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监视目录 {directory}")
+        return wd
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """读取全部可用的事件，返回(wd, mask, 文件名)"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    监视一组目录，把一批文件事件交给回调
+    inotify可用时注册到事件循环的读回调中，否则每POLL_INTERVAL秒比较一次快照
+    同一批次内的事件在DEBOUNCE秒内合并后回调，连续写入同一文件只报告一次
+    """
+    POLL_INTERVAL = 1.0
+    DEBOUNCE = 0.05
+
+    def __init__(self, callback: Callable[[list[FileEvent]], None], use_inotify: bool = True):
+        self.callback = callback
+        self.directories: dict[Path, object] = {}  # 目录 -> inotify的wd或轮询的快照
+        self.pending: list[FileEvent] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.inotify: Optional[_Inotify] = None
+        self.wds: dict[int, Path] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.inotify = _Inotify()
+            except (OSError, AttributeError):
+                self.inotify = None
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self.inotify is not None else "polling"
+
+    def start(self):
+        """在事件循环中开始监视"""
+        self.loop = asyncio.get_running_loop()
+        if self.inotify is not None:
+            self.loop.add_reader(self.inotify.fd, self._on_readable)
+        else:
+            self._poll_task = self.loop.create_task(self._poll())
+
+    def close(self):
+        self.set_directories([])
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self.inotify is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+
+    def set_directories(self, directories: Iterable[Path]):
+        """替换监视的目录，不存在的目录被跳过"""
+        directories = {Path(directory) for directory in directories}
+        for directory in set(self.directories) - directories:
+            watched = self.directories.pop(directory)
+            if self.inotify is not None:
+                self.wds.pop(watched, None)
+                self.inotify.rm_watch(self.inotify.fd, watched)
+        for directory in directories - set(self.directories):
+            if not directory.is_dir():
+                continue
+            if self.inotify is not None:
+                try:
+                    wd = self.inotify.watch(directory)
+                except OSError:
+                    continue
+                self.wds[wd] = directory
+                self.directories[directory] = wd
+            else:
+                self.directories[directory] = snapshot(directory)
+
+    def _on_readable(self):
+        for wd, mask, name in self.inotify.read():
+            if mask & _Inotify.IN_Q_OVERFLOW:
+                # 内核队列溢出，丢失的事件由调用方重新扫描目录补齐
+                self.pending.extend(FileEvent("rescan", directory) for directory in self.directories)
+                continue
+            directory = self.wds.get(wd)
+            if directory is None or not name or mask & (_Inotify.IN_ISDIR | _Inotify.IN_IGNORED):
+                continue
+            if mask & (_Inotify.IN_CREATE | _Inotify.IN_MOVED_TO):
+                kind = "add"
+            elif mask & (_Inotify.IN_DELETE | _Inotify.IN_MOVED_FROM):
+                kind = "remove"
+            else:
+                kind = "modify"
+            self.pending.append(FileEvent(kind, directory / name))
+        self._schedule_flush()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            for directory, old in list(self.directories.items()):
+                new = snapshot(directory)
+                if new == old:
+                    continue
+                self.directories[directory] = new
+                self.pending.extend(FileEvent("add", path) for path in new.keys() - old.keys())
+                self.pending.extend(FileEvent("remove", path) for path in old.keys() - new.keys())
+                self.pending.extend(FileEvent("modify", path) for path in new.keys() & old.keys()
+                                    if new[path] != old[path])
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.pending and self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.DEBOUNCE, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        events, self.pending = coalesce(self.pending), []
+        if events:
+            self.callback(events)
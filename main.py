@@ -6,13 +6,14 @@ from colorama import Fore, Style
 
 import core.cache
 from command.commands import CommandHandler
-from command.file import read_file_content
 from core import cache
 from core.Project import Project
 from core.SurrogateIO import sio_print, try_create_message
 from core.cache import Configure, GlobalFlag
+from core.context import ContextAssembler
 from core.communicate import communicate
 from core.history import History, MessageRole
+from core.metrics import Metrics
 from core.prompt import reload_prompt
 from core.source.sources import SourceRegistry
 from core.sync.StateManager import StateManager, State, InitStateManager
@@ -52,10 +53,10 @@ async def main():
     already_warn_cache = False  # 是否已经提醒过缓存未提交
 
     await init_manager.set_state(InitStateManager.InitState.LOADING_REFERENCE)
-    reload_file(history)
+    await reload_file(history)
 
     await init_manager.set_state(InitStateManager.InitState.LOADING_CODE)
-    reload_code(history)
+    await reload_code(history)
 
     await init_manager.set_state(InitStateManager.InitState.FINISH)
     try_create_message(MsgType.SYSTEM)
@@ -91,6 +92,7 @@ async def main():
                         history.add_message(MessageRole.SYSTEM, for_model, for_user)
                     try_create_message(MsgType.SYSTEM)
                     sio_print(f"\n[系统提示] {for_user}")
+                    await cmd_handler.wait_pending()
                     continue
 
                 if not already_warn_cache and len(cache.CatchInformation.get_instance().info) != 0:
@@ -116,18 +118,26 @@ async def main():
                                         "")
             GlobalFlag.get_instance().skip_user_input = False
 
+            metrics = Metrics.get_instance()
+            metrics.begin_turn()
             # ------------------------------
             # 重新加载提示词、文件、代码、工具
-            reload_prompt(history, info=False)
-            reload_file(history, info=False)
-            reload_code(history, info=False)
-            reload_tool(history, info=False)
+            with metrics.phase("reload_prompt"):
+                reload_prompt(history, info=False)
+            with metrics.phase("reload_file"):
+                await reload_file(history, info=False)
+            with metrics.phase("reload_code"):
+                await reload_code(history, info=False)
+            with metrics.phase("reload_tool"):
+                reload_tool(history, info=False)
 
             # ------------------------------
             # 调用AI
             # ------------------------------
             try:
-                think, full_response = await communicate(history.to_message())
+                with metrics.phase("to_message"):
+                    message = history.to_message(budget=configure.max_context_tokens)
+                think, full_response = await communicate(message)
             except Exception as e:
                 sio_print(f" communicate 错误: {e}")
             # ------------------------------
@@ -144,7 +154,9 @@ async def main():
 
             GlobalFlag.get_instance().is_communicating = False
             # 保存对话记录
-            history.save()
+            with metrics.phase("history_save"):
+                history.save()
+            metrics.end_turn()
 
         except KeyboardInterrupt:
             sio_print("\n检测到中断信号，正在退出...")
@@ -154,89 +166,120 @@ async def main():
             sio_print(f"\n发生错误: {str(e)}")
 
 
-def reload_file(history, info=True):
+# 文件数不少于此值时显示加载进度，每完成约十分之一显示一次
+PROGRESS_MIN_FILES = 10
+
+
+async def report_init_progress(file: Path, done: int, total: int):
+    """将单个文件的加载进度报告给初始化状态管理器，文件较多时同时显示在界面上"""
+    if InitStateManager.instance is not None:
+        await InitStateManager.instance.report_progress(file.name, done, total)
+    if total >= PROGRESS_MIN_FILES and (done == total or done % (total // 10) == 0):
+        sio_print(f"已加载 {done}/{total} 个文件")
+
+
+async def reload_file(history, info=True):
     if info:
         try_create_message(MsgType.SYSTEM)
         sio_print(f"\n清空AI文件记忆")
-    # 移除history中具有file标签的消息
-    history.history = [msg for msg in history.history if "file" not in msg.tags]
-    # 遍历 ref_space/ 文件夹下的所有文件
-    file_count = 0
+    # 遍历 ref_space/ 文件夹下的所有文件，未变化的文件直接使用缓存，变化的文件在线程池中并发读取
+    assembler = ContextAssembler.get_instance()
+    messages = []
     if (Project.instance.root_path / "ref_space/").exists():
-        for file in (Project.instance.root_path / "ref_space/").iterdir():
-            if file.is_file():
-                # 使用file.read_file_content(file)读取文件内容
-                try:
-                    history.add_message_head(MessageRole.SYSTEM, read_file_content(file), "", tags=["file"])
-                except ValueError as e:
-                    if info:
-                        sio_print(f"读取文件{file}失败，已跳过: {e}")
-                    continue
-                file_count += 1
-        if file_count != 0:
-            msg = f"从 参考文献 中读取到了{file_count}个本地文件提交给AI"
+        files = assembler.list_files(Project.instance.root_path / "ref_space/")
+        results = await assembler.load("file", files, report_init_progress if info else None)
+        for file, result in zip(files, results):
+            if isinstance(result, Exception):
+                if info:
+                    sio_print(f"读取文件{file}失败，已跳过: {result}")
+                continue
+            messages.append(result)
+        if len(messages) != 0:
+            msg = f"从 参考文献 中读取到了{len(messages)}个本地文件提交给AI"
             if info:
                 sio_print(msg)
         else:
             msg = f"未在 参考文献 中读取到本地文件"
             if info:
                 sio_print(msg)
-
-
-def reload_code(history, info=True):
+    chunks = retrieve_reference(history, messages)
+    # 替换history中具有file标签的消息，使用检索时完整的文件不放入上下文，片段放在对话之后的retrieval分段
+    history.splice("file", assembler.order(messages) if chunks is None else [])
+    history.splice("retrieval", chunks or [])
+
+
+def retrieve_reference(history, messages):
+    """
+    参考文献的总token数超过上限时，返回与最近对话相关的片段，未超过上限时返回None
+    检索结果不变时返回同一组消息，History.splice不会更新分段
+    """
+    configure = Configure.get_instance()
+    limit = configure.ref_full_inject_tokens
+    assembler = ContextAssembler.get_instance()
+    if limit == -1 or assembler.token_total(messages) <= limit:
+        return None
+
+    # 检索依赖NumPy，只在需要时导入，避免拖慢启动
+    from core.retrieval import RetrievalIndex, latest_query
+    index = RetrievalIndex.get_instance()
+    for msg in messages:
+        index.update(msg.source, msg.digest, msg.for_model)
+    index.retain({msg.source for msg in messages})
+    return index.select(latest_query(history), configure.ref_top_k)
+
+
+async def reload_code(history, info=True):
     if info:
         try_create_message(MsgType.SYSTEM)
         sio_print(f"\n清空AI代码记忆")
-    history.history = [msg for msg in history.history if "code" not in msg.tags]
-    # 遍历 ref_space/ 文件夹下的所有文件
-    file_count = 0
+    # 遍历 code_space/ 文件夹下的所有文件
+    assembler = ContextAssembler.get_instance()
+    messages = []
     if (Project.instance.root_path / "code_space/").exists():
-        for file in (Project.instance.root_path / "code_space/").iterdir():
-            if file.is_file():
-                try:
-                    history.add_message_head(MessageRole.SYSTEM,
-                                             f"*代码空间*可编辑文件{file.name}" + read_file_content(file), "",
-                                             tags=["code"])
-                except ValueError as e:
-                    if info:
-                        sio_print(f"读取代码{file}失败，已跳过: {e}")
-                    continue
-                file_count += 1
-        if file_count != 0:
-            msg = f"从 代码空间 中读取到了{file_count}个本地文件提交给AI"
+        files = assembler.list_files(Project.instance.root_path / "code_space/")
+        results = await assembler.load("code", files, report_init_progress if info else None)
+        for file, result in zip(files, results):
+            if isinstance(result, Exception):
+                if info:
+                    sio_print(f"读取代码{file}失败，已跳过: {result}")
+                continue
+            messages.append(result)
+        if len(messages) != 0:
+            msg = f"从 代码空间 中读取到了{len(messages)}个本地文件提交给AI"
             if info:
                 sio_print(msg)
         else:
             msg = f"未在 代码空间 中读取到本地文件"
             if info:
                 sio_print(msg)
+    history.splice("code", assembler.order(messages))
 
 
 def reload_tool(history, info=True):
     if info:
         try_create_message(MsgType.SYSTEM)
         sio_print(f"\n清空AI代码记忆")
-    history.history = [msg for msg in history.history if "tool" not in msg.tags]
 
-    file_count = 0
+    assembler = ContextAssembler.get_instance()
+    messages = []
     if Path("./resource/prompt/tool").exists():
-        for file in Path("./resource/prompt/tool").iterdir():
-            if file.is_file() and file.suffix == ".txt" and history.tool_settings.get(file.stem, True):
+        for file in assembler.list_files(Path("./resource/prompt/tool")):
+            if file.suffix == ".txt" and history.tool_settings.get(file.stem, True):
                 try:
-                    history.add_message_head(MessageRole.SYSTEM, f"加载*工具*信息{file.stem}" + read_file_content(file),
-                                             "", tags=["tool"])
+                    messages.append(assembler.build("tool", file))
                 except ValueError as e:
                     if info:
                         sio_print(f"读取工具{file}失败，已跳过: {e}")
                     continue
-        if file_count != 0:
-            msg = f"加载了{file_count}个启用的AI工具"
+        if len(messages) != 0:
+            msg = f"加载了{len(messages)}个启用的AI工具"
             if info:
                 sio_print(msg)
         else:
             msg = f"没有启用任何工具"
             if info:
                 sio_print(msg)
+    history.splice("tool", assembler.order(messages))
 
 
 if __name__ == "__main__":
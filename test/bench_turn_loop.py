@@ -0,0 +1,357 @@
+# 对话循环的基准测试
+# 以无界面模式运行main.main()，用脚本提供用户输入，AI源使用本地的模拟源或Replay录像，不需要网络
+# 分别扫描对话长度、参考文献数量与工具输出量，把各阶段耗时与内存峰值写入JSON，便于在提交之间比较
+#
+# 用法: python -m test.bench_turn_loop [--quick] [--grid] [--output bench_output.json]
+import argparse
+import asyncio
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import main
+from core.Project import Project
+from core.SurrogateIO import StreamSink
+from core.cache import CatchInformation, Configure, GlobalFlag
+from core.context import ContextAssembler
+from core.extract import ExtractStore
+from core.history import History, MessageRole
+from core.metrics import Metrics, percentile
+from core.source.sources import BaseSource, SourceRegistry
+from core.sync.StateManager import InitStateManager
+
+HISTORY_SIZES = (10, 100, 1000, 10000)
+REF_COUNTS = (0, 20, 200)
+TOOL_KB = (0, 64, 1024)
+QUICK = {"history": (10, 1000), "refs": (0, 50), "tool_kb": (0, 64)}
+PROJECT = "bench"
+
+
+@SourceRegistry.register("Bench")
+class BenchSource(BaseSource):
+    """按固定内容分块输出的模拟源，tool_kb大于0时在回复中调用运行工具"""
+    run_tool = False
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @classmethod
+    async def create_stream_async(cls, message: list[dict]):
+        reply = "根据参考文献与之前的对话，整理出以下要点。\n" * 8
+        if cls.run_tool:
+            reply += "运行代码查看输出：<run>"
+
+        async def stream():
+            for i in range(0, len(reply), 16):
+                await asyncio.sleep(0)
+                yield reply[i:i + 16]
+        return stream()
+
+    @classmethod
+    def catch_chunk_in_stream(cls, chunk) -> [str, str]:
+        return "", chunk
+
+
+def pdf_bytes(lines: list[str], per_page: int = 60) -> bytes:
+    """生成每页per_page行文本的PDF，使用内置的Helvetica字体，只支持ASCII文本"""
+    pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)] or [[]]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        text = " ".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*"
+                        for line in page)
+        stream = f"BT /F1 10 Tf 12 TL 40 780 Td {text} ET".encode("ascii")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(data)
+
+
+def write_ooxml(path: Path, main_part: str, parts: dict[str, tuple[str, str]]):
+    """生成最小的Office Open XML文件，parts为包内路径 -> (内容类型, XML)，main_part为主文档的路径"""
+    overrides = "".join(f'<Override PartName="/{name}" ContentType="{content_type}"/>'
+                        for name, (content_type, _) in parts.items() if content_type)
+    content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="rels" '
+                     'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                     f'<Default Extension="xml" ContentType="application/xml"/>{overrides}</Types>')
+    rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+            f'officeDocument" Target="{main_part}"/></Relationships>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("_rels/.rels", rels)
+        for name, (_, xml) in parts.items():
+            archive.writestr(name, xml)
+
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+OOXML_TYPE = "application/vnd.openxmlformats-officedocument."
+
+
+def write_docx(path: Path, paragraphs: list[str]):
+    body = "".join(f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>" for text in paragraphs)
+    write_ooxml(path, "word/document.xml", {
+        "word/document.xml": (OOXML_TYPE + "wordprocessingml.document.main+xml",
+                              f'{XML_HEADER}<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                              f'wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>'),
+    })
+
+
+def write_xlsx(path: Path, rows: list[list[str]]):
+    def cell(value: str) -> str:
+        return f'<c t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+    sheet = "".join(f'<row r="{i}">{"".join(cell(value) for value in row)}</row>' for i, row in enumerate(rows, 1))
+    write_ooxml(path, "xl/workbook.xml", {
+        "xl/workbook.xml": (OOXML_TYPE + "spreadsheetml.sheet.main+xml",
+                            f'{XML_HEADER}<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+                            'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                            '<sheets><sheet name="数据" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+        "xl/_rels/workbook.xml.rels": ("",
+                                       f'{XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/'
+                                       'package/2006/relationships"><Relationship Id="rId1" '
+                                       'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+                                       'worksheet" Target="worksheets/sheet1.xml"/></Relationships>'),
+        "xl/worksheets/sheet1.xml": (OOXML_TYPE + "spreadsheetml.worksheet+xml",
+                                     f'{XML_HEADER}<worksheet xmlns="http://schemas.openxmlformats.org/'
+                                     f'spreadsheetml/2006/main"><sheetData>{sheet}</sheetData></worksheet>'),
+    })
+
+
+# 需要提取的格式，解析依赖的库未安装时由write_refs改为生成txt
+EXTRACTED_KINDS = ("pdf", "docx", "xlsx")
+_readable: dict[str, bool] = {}
+
+
+def readable(kind: str, sample: Path) -> bool:
+    """当前环境能否提取该格式，按格式只检查一次"""
+    if kind not in _readable:
+        from command.file import EXTRACTORS
+        try:
+            _readable[kind] = bool(EXTRACTORS[sample.suffix][0](sample))
+        except Exception as e:
+            print(f"无法提取{kind}格式，改为生成txt: {e}", file=sys.stderr)
+            _readable[kind] = False
+    return _readable[kind]
+
+
+def write_refs(directory: Path, count: int):
+    """
+    生成混合格式的参考文献，每个文件约4KB的文本
+    PDF、DOCX与XLSX需要提取，首次加载时未命中ExtractStore，由提取进程池解析
+    """
+    paragraph = "检索增强生成把外部知识放入上下文。Retrieval augmented generation keeps the context small. "
+    english = "Retrieval augmented generation keeps the context small and the prefix cache warm."
+    for i in range(count):
+        kind = ("txt", "csv", "json", "py", *EXTRACTED_KINDS)[i % (4 + len(EXTRACTED_KINDS))]
+        if kind == "pdf":
+            path = directory / f"paper_{i}.pdf"
+            path.write_bytes(pdf_bytes([f"{j:03d} {english}" for j in range(50)]))
+        elif kind == "docx":
+            path = directory / f"report_{i}.docx"
+            write_docx(path, [paragraph] * 40)
+        elif kind == "xlsx":
+            path = directory / f"sheet_{i}.xlsx"
+            write_xlsx(path, [["id", "名称", "数值"]] + [[str(j), f"样本{j}", str(j * 0.5)] for j in range(150)])
+        if kind in EXTRACTED_KINDS:
+            if readable(kind, path):
+                continue
+            path.unlink()
+            kind = "txt"
+
+        if kind == "txt":
+            (directory / f"note_{i}.txt").write_text(paragraph * 40, encoding='utf-8')
+        elif kind == "csv":
+            rows = "\n".join(f"{j},样本{j},{j * 0.5}" for j in range(150))
+            (directory / f"table_{i}.csv").write_text("id,名称,数值\n" + rows, encoding='utf-8')
+        elif kind == "json":
+            data = {"id": i, "items": [{"title": f"条目{j}", "text": paragraph} for j in range(30)]}
+            (directory / f"data_{i}.json").write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        else:
+            body = "\n".join(f"def func_{j}(x):\n    return x * {j}\n" for j in range(120))
+            (directory / f"module_{i}.py").write_text(body, encoding='utf-8')
+
+
+def write_tool_program(directory: Path, tool_kb: int):
+    """代码空间中的main.py，运行时输出约tool_kb KB的文本"""
+    (directory / "main.py").write_text(
+        "def main():\n"
+        f"    for i in range({tool_kb * 16}):\n"
+        "        print(f'line {i:06d} ' + 'x' * 50)\n", encoding='utf-8')
+
+
+def reset_state():
+    """清空上一次运行留下的单例"""
+    if ContextAssembler.instance is not None:
+        ContextAssembler.instance.pool.shutdown(wait=True)
+    for cls in (Project, ContextAssembler, Metrics, Configure, GlobalFlag, CatchInformation, InitStateManager,
+                StreamSink):
+        cls.instance = None
+    History.MAIN_HISTORY = None
+    from core.retrieval import RetrievalIndex
+    RetrievalIndex.instances.clear()
+    ExtractStore.instances.clear()
+
+
+def prepare(history_size: int, ref_count: int, tool_kb: int, replay: str = None):
+    """在临时目录中生成项目、对话记录与配置，每个场景使用新的项目目录，提取缓存从空开始"""
+    reset_state()
+    shutil.rmtree(Path("projects") / PROJECT, ignore_errors=True)
+    project = Project(PROJECT)
+    project.setup()
+    write_refs(project.dirs["ref"], ref_count)
+    if tool_kb > 0:
+        write_tool_program(project.dirs["code"], tool_kb)
+    BenchSource.run_tool = tool_kb > 0
+
+    history = History(name="bench")
+    for i in range(history_size):
+        if i % 2 == 0:
+            history.add_message(MessageRole.USER, f"第{i}个问题：如何降低长对话的延迟？", "")
+        else:
+            history.add_message(MessageRole.ASSISTANT, "可以缓存上下文并只发送变化的部分。" * 4, "")
+    history.save()
+    History.MAIN_HISTORY = history
+
+    if replay is None:
+        Configure.instance = Configure(active_ai="Bench", active_model={"Bench": "stub"}, hedge_after=-1)
+    else:
+        Configure.instance = Configure(active_ai="Replay", active_model={"Replay": replay}, hedge_after=-1,
+                                       replay_dir=str(REPO_ROOT / "replay"), replay_speed=0)
+
+
+def run_scenario(history_size: int, ref_count: int, tool_kb: int, turns: int, memory: bool,
+                 replay: str = None) -> dict:
+    """运行一次main.main()，返回启动耗时、每轮耗时、各阶段耗时与内存峰值"""
+    prepare(history_size, ref_count, tool_kb, replay)
+    script = [f"第{i}轮：请总结参考文献" for i in range(turns)] + ["/exit"]
+    calls: list[float] = []
+
+    def scripted_input(prompt=""):
+        calls.append(time.perf_counter())
+        return script[len(calls) - 1]
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    original_input = builtins.input
+    builtins.input = scripted_input
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(main.main())
+    finally:
+        builtins.input = original_input
+    end = time.perf_counter()
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    metrics = Metrics.get_instance()
+    summary = metrics.summary()
+    turn_wall = [b - a for a, b in zip(calls, calls[1:])]
+    durations = [request["duration"] for request in metrics.requests if "duration" in request]
+    return {
+        "history": history_size,
+        "refs": ref_count,
+        "tool_kb": tool_kb,
+        "startup": round(calls[0] - start, 6) if calls else round(end - start, 6),
+        "turn_wall": {"median": round(statistics.median(turn_wall), 6), "max": round(max(turn_wall), 6)}
+        if turn_wall else {},
+        "phases": {name: {"median": round(statistics.median(values), 6), "p95": round(percentile(values, 0.95), 6)}
+                   for name, values in sorted(summary["phases"].items())},
+        "request_median": round(statistics.median(durations), 6) if durations else None,
+        "peak_memory_mb": round(peak / 2 ** 20, 3) if peak is not None else None,
+    }
+
+
+def scenarios(args) -> list[tuple[int, int, int]]:
+    """默认每次只改变一个维度，其余取最小值；--grid时运行全部组合"""
+    histories = QUICK["history"] if args.quick else HISTORY_SIZES
+    refs = QUICK["refs"] if args.quick else REF_COUNTS
+    tools = QUICK["tool_kb"] if args.quick else TOOL_KB
+    if args.grid:
+        return [(h, r, t) for h in histories for r in refs for t in tools]
+    result = [(h, refs[0], tools[0]) for h in histories]
+    result += [(histories[0], r, tools[0]) for r in refs[1:]]
+    result += [(histories[0], refs[0], t) for t in tools[1:]]
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main_entry():
+    parser = argparse.ArgumentParser(description="对话循环基准测试")
+    parser.add_argument("--quick", action="store_true", help="使用较小的扫描范围")
+    parser.add_argument("--grid", action="store_true", help="运行全部参数组合")
+    parser.add_argument("--turns", type=int, default=3, help="每个场景的对话轮数")
+    parser.add_argument("--no-memory", action="store_true", help="不统计内存峰值，tracemalloc会拖慢运行")
+    parser.add_argument("--replay", default=None, help="使用仓库replay/目录下的录像集代替模拟源")
+    parser.add_argument("--output", default="bench_output.json", help="结果文件")
+    args = parser.parse_args()
+    output = Path(args.output).resolve()
+
+    results = []
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="bench_turn_loop_") as workspace:
+        # 提示词与工具说明按相对路径读取，在临时目录中链接到仓库的resource
+        os.symlink(REPO_ROOT / "resource", Path(workspace) / "resource", target_is_directory=True)
+        os.chdir(workspace)
+        try:
+            for history_size, ref_count, tool_kb in scenarios(args):
+                result = run_scenario(history_size, ref_count, tool_kb, args.turns, not args.no_memory, args.replay)
+                results.append(result)
+                print(f"history={history_size} refs={ref_count} tool_kb={tool_kb} "
+                      f"startup={result['startup']:.3f}s turn={result['turn_wall'].get('median', 0):.3f}s "
+                      f"peak={result['peak_memory_mb']}MB", file=sys.stderr)
+        finally:
+            reset_state()
+            os.chdir(cwd)
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "turns": args.turns,
+              "memory": not args.no_memory, "scenarios": results}
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding='utf-8')
+    print(f"结果已写入 {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_entry()
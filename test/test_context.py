@@ -0,0 +1,53 @@
+from core.context import ContextAssembler
+
+
+def test_read_cached(tmp_path):
+    file = tmp_path / "a.txt"
+    file.write_text("hello", encoding="utf-8")
+    assembler = ContextAssembler()
+
+    entry = assembler.read(file)
+    assert entry.content == "hello"
+    assert assembler.read(file) is entry
+
+    file.write_text("world!", encoding="utf-8")
+    assert assembler.read(file).content == "world!"
+
+
+def test_list_files_reuse(tmp_path):
+    (tmp_path / "a.txt").write_text("a", encoding="utf-8")
+    assembler = ContextAssembler()
+
+    files = assembler.list_files(tmp_path)
+    assert assembler.list_files(tmp_path) is files
+    assert assembler.list_files(tmp_path / "missing") == []
+
+
+def test_load_ordered(tmp_path):
+    import asyncio
+    files = []
+    for name in ["c.txt", "a.txt", "b.csv", "bad.xyz"]:
+        (tmp_path / name).write_text("x,y\n1,2" if name.endswith(".csv") else name, encoding="utf-8")
+        files.append(tmp_path / name)
+    assembler = ContextAssembler()
+    seen = []
+
+    async def progress(file, done, total):
+        seen.append((done, total))
+
+    results = asyncio.run(assembler.load("file", files, progress))
+    assert [msg.source for msg in results[:3]] == [str(file) for file in files[:3]]
+    assert isinstance(results[3], ValueError)
+    assert sorted(seen) == [(1, 4), (2, 4), (3, 4), (4, 4)]
+
+
+def test_order_stable_on_edit(tmp_path):
+    for name in ["b.txt", "a.txt", "c.txt"]:
+        (tmp_path / name).write_text(name, encoding="utf-8")
+    assembler = ContextAssembler()
+    files = assembler.list_files(tmp_path)
+    before = [msg.source for msg in assembler.order([assembler.build("file", file) for file in files])]
+    (tmp_path / "a.txt").write_text("修改后的内容", encoding="utf-8")
+    assembler.invalidate(tmp_path / "a.txt")
+    after = [msg.source for msg in assembler.order([assembler.build("file", file) for file in files])]
+    assert before == after == sorted(before)
@@ -0,0 +1,41 @@
+from core.extract import ExtractStore
+
+
+def test_store_roundtrip(tmp_path):
+    source = tmp_path / "paper.pdf"
+    source.write_bytes(b"%PDF-fake")
+    (tmp_path / "extract").mkdir()
+    store = ExtractStore(tmp_path / "extract")
+
+    assert store.get(source, 1) is None
+    store.put(source, 1, "提取的文本")
+    assert store.get(source, 1) == "提取的文本"
+    assert store.get(source, 2) is None
+
+    source.unlink()
+    store.evict(source)
+    assert list((tmp_path / "extract").glob("*.txt")) == []
+
+
+def _pid(path):
+    import os
+    return os.getpid()
+
+
+def test_single_extraction_inline(tmp_path, monkeypatch):
+    import os
+    import core.extract
+    from core.extract import run_extractor
+    monkeypatch.setattr(core.extract, "_extract_pool", None)
+    assert run_extractor(_pid, tmp_path / "paper.pdf") == os.getpid()
+    assert core.extract._extract_pool is None
+
+
+def test_atomic_write_and_digest(tmp_path):
+    from util.storage import atomic_write, file_digest, text_digest
+    target = tmp_path / "index.json"
+    atomic_write(target, "内容")
+    atomic_write(target, "新内容".encode("utf-8"))
+    assert target.read_text(encoding="utf-8") == "新内容"
+    assert [path.name for path in tmp_path.iterdir()] == ["index.json"]
+    assert file_digest(target) == text_digest("新内容")
@@ -0,0 +1,142 @@
+from core.history import History, Message, MessageRole
+
+
+def _open_project(name, tmp_path, monkeypatch):
+    """在临时目录中创建项目，测试结束时由monkeypatch恢复项目、主对话记录与上下文组装器单例"""
+    from core.Project import Project
+    from core.context import ContextAssembler
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Project, "instance", None)
+    monkeypatch.setattr(History, "MAIN_HISTORY", None)
+    monkeypatch.setattr(ContextAssembler, "instance", None)
+    project = Project(name)
+    project.setup()
+    return project
+
+
+def test_segments_order():
+    history = History()
+    history.add_message(MessageRole.USER, "你好", "你好")
+    history.splice("file", [Message(MessageRole.SYSTEM, "参考", "", tags=["file"], source="a.txt")])
+    history.splice("prompt", [Message(MessageRole.SYSTEM, "提示词", "", tags=["prompt"], source="p.txt")])
+    history.splice("retrieval", [Message(MessageRole.SYSTEM, "片段", "", tags=["retrieval"], source="b.txt#0")])
+    history.add_message(MessageRole.ASSISTANT, "回复", "回复")
+
+    # 每轮变化的检索片段在对话之后，不影响对话之前的前缀
+    assert [msg["content"] for msg in history.to_message()] == ["提示词", "参考", "你好", "回复", "片段"]
+
+
+def test_splice_in_place():
+    history = History()
+    first = Message(MessageRole.SYSTEM, "v1", "", tags=["code"], source="main.py")
+    history.splice("code", [first])
+    segment = history.segments["code"]
+
+    history.splice("code", [Message(MessageRole.SYSTEM, "v2", "", tags=["code"], source="main.py")])
+    assert history.segments["code"] is segment
+    assert first.for_model == "v2"
+
+
+def test_wire_memoized():
+    from core.communicate import rewrite_system
+    history = History()
+    history.splice("prompt", [Message(MessageRole.SYSTEM, "提示词", "", tags=["prompt"], source="p.txt")])
+    history.add_message(MessageRole.USER, "你好", "你好")
+    history.add_message(MessageRole.SYSTEM, "工具结果", "")
+    first = history.to_message()
+
+    history.add_message(MessageRole.ASSISTANT, "回复", "回复")
+    second = history.to_message()
+    assert all(a is b for a, b in zip(first, second))
+
+    sent = rewrite_system(second)
+    assert second[2]["role"] == "system"
+    assert sent[0] is second[0] and sent[2]["role"] == "user"
+    assert rewrite_system(second)[2] is sent[2]
+
+
+def test_journal_replay(tmp_path, monkeypatch):
+    _open_project("journal", tmp_path, monkeypatch)
+
+    history = History.get_or_create()
+    history.add_message(MessageRole.USER, "第一条", "第一条")
+    history.save()
+    history.add_message(MessageRole.ASSISTANT, "第二条", "第二条")
+    history.tool_settings["fetch"] = False
+    history.save()
+
+    journal = History.journal_file(history.name)
+    assert journal.exists()
+    # 模拟崩溃时写了一半的记录
+    with journal.open("a", encoding="utf-8") as f:
+        f.write('{"op": "add", "mess')
+
+    loaded = History.load(history.name)
+    assert [msg.for_model for msg in loaded.messages()] == ["第一条", "第二条"]
+    assert loaded.tool_settings == {"fetch": False}
+
+    loaded.compact(background=False)
+    assert History.journal_file(loaded.name).read_text(encoding="utf-8") == ""
+    assert [msg.for_model for msg in History.load(loaded.name).messages()] == ["第一条", "第二条"]
+
+
+def test_derived_saved_as_reference(tmp_path, monkeypatch):
+    from core.context import ContextAssembler
+    project = _open_project("reference", tmp_path, monkeypatch)
+    ref = project.root_path / "ref_space" / "a.txt"
+    ref.write_text("参考内容" * 100, encoding="utf-8")
+
+    history = History.get_or_create()
+    history.splice("file", [ContextAssembler().build("file", ref)])
+    history.add_message(MessageRole.USER, "问题", "问题")
+    history.save()
+
+    assert "参考内容" not in History.snapshot_file(history.name).read_text(encoding="utf-8")
+    loaded = History.load(history.name)
+    assert loaded.segments["file"][0].for_model == "参考内容" * 100
+    assert '"source": "ref_space/a.txt"' in History.snapshot_file(history.name).read_text(encoding="utf-8")
+
+    # 来源文件修改后按当前内容重建，不另外保存旧内容
+    ref.write_text("修改后的内容", encoding="utf-8")
+    assert History.load(history.name).segments["file"][0].for_model == "修改后的内容"
+    assert not (project.root_path / "history" / "blobs").exists()
+
+
+def test_history_index(tmp_path, monkeypatch):
+    from core.history import HistoryIndex
+    _open_project("index", tmp_path, monkeypatch)
+
+    history = History(name="first")
+    history.add_message(MessageRole.USER, "如何缓存上下文？\n补充说明", "如何缓存上下文？\n补充说明")
+    history.add_message(MessageRole.ASSISTANT, "回复", "回复")
+    history.save()
+    (tmp_path / "projects/index/history/legacy.json").write_text('{"messages": []}', encoding='utf-8')
+
+    entries = HistoryIndex.get_instance().listing()
+    assert entries["first"]["title"] == "如何缓存上下文？" and entries["first"]["messages"] == 2
+    assert entries["legacy"]["messages"] is None and "index" not in entries
+
+    history.rename("second")
+    assert set(HistoryIndex(tmp_path / "projects/index/history").listing()) == {"second", "legacy"}
+
+
+def test_rewrite_waits_for_compaction(tmp_path, monkeypatch):
+    import threading
+    _open_project("compact", tmp_path, monkeypatch)
+
+    history = History(name="race")
+    history.add_message(MessageRole.USER, "旧消息", "旧消息")
+    history.save()
+    release = threading.Event()
+    history._compactor = threading.Thread(target=release.wait)
+    history._compactor.start()
+
+    history.history = [Message(MessageRole.USER, "新消息", "新消息")]
+    saver = threading.Thread(target=history.save)
+    saver.start()
+    saver.join(0.2)
+    assert saver.is_alive()
+    release.set()
+    saver.join(1)
+    assert not saver.is_alive()
+    assert History.load("race").segments["conversation"][0].for_model == "新消息"
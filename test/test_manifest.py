@@ -0,0 +1,17 @@
+import sys
+
+from util.manifest import scan
+
+
+def test_scan_without_import():
+    entries = scan("command", "command")
+    paths = {entry.kwargs["path"]: entry.module for entry in entries}
+    assert paths["/model/set"] == "command.model"
+    assert paths["/exit"] == "command.exit"
+
+
+def test_lazy_command():
+    from command.commands import CommandHandler, LazyCommand, registry
+    assert CommandHandler().handle_command("/api google") == ("请提供API", "")
+    assert "command.api" in sys.modules
+    assert not isinstance(registry.root.subcommands["api"].subcommands["google"], LazyCommand)
@@ -0,0 +1,84 @@
+import asyncio
+
+from textual.app import App
+
+from textual.widgets import MarkdownViewer
+
+from tui.message import ChatMessage, CopyText, MarkdownCache, MessageDisplay, MsgType
+
+
+class DisplayApp(App):
+    def compose(self):
+        yield MessageDisplay()
+
+
+def test_incremental_render():
+    async def run():
+        app = DisplayApp()
+        async with app.run_test() as pilot:
+            display = app.query_one(MessageDisplay)
+            for i in range(3):
+                display.create_message(MsgType.SYSTEM, f"消息{i}")
+            await pilot.pause()
+            widgets = [display.rendered[i].widget for i in range(3)]
+
+            display.create_message(MsgType.ASSISTANT, "你")
+            display.append_content("好")
+            display.add_content("好")
+            await pilot.pause()
+            assert [display.rendered[i].widget for i in range(3)] == widgets
+            assert len(display.rendered) == 4
+            assert display.rendered[3].widget.text == "assistant:\n你好"
+
+            display.show_raw = False
+            await pilot.pause()
+            assert len(display.rendered) == 4
+            assert not any(isinstance(child, CopyText) for child in display.children)
+
+            display.messages = display.messages[:2] + [ChatMessage("新的消息", MsgType.USER)]
+            await pilot.pause()
+            assert len(display.rendered) == 3
+
+    asyncio.run(run())
+
+
+def test_virtualized_render():
+    async def run():
+        app = DisplayApp()
+        async with app.run_test() as pilot:
+            display = app.query_one(MessageDisplay)
+            display.messages = [ChatMessage(f"消息{i}", MsgType.SYSTEM) for i in range(5000)]
+            await pilot.pause()
+            assert 0 < len(display.rendered) < 50
+            assert 4999 in display.rendered
+
+            display.scroll_home(animate=False)
+            await pilot.pause()
+            assert 0 in display.rendered and 4999 not in display.rendered
+            assert len(display.children) == len(display.rendered) + 2
+
+    asyncio.run(run())
+
+
+def test_rendered_streaming():
+    async def run():
+        app = DisplayApp()
+        async with app.run_test() as pilot:
+            display = app.query_one(MessageDisplay)
+            display.show_raw = False
+            MarkdownCache.get_instance().entries.clear()
+            long_text = "# 标题\n\n" + "很长的段落。" * 100
+            display.create_message(MsgType.SYSTEM, long_text)
+            display.create_message(MsgType.ASSISTANT, "第一段\n\n")
+            await pilot.pause()
+            for chunk in ["第二", "段" * 300, "\n\n- 列表"]:
+                display.append_content(chunk)
+                display.add_content(chunk)
+                await pilot.pause()
+            document = display.rendered[1].widget.query_one(MarkdownViewer).document
+            assert document.source == "第一段\n\n第二" + "段" * 300 + "\n\n- 列表"
+            # 只缓存完整消息的解析结果，流式追加的末尾块不写入缓存
+            assert len(MarkdownCache.get_instance().entries) == 1
+            assert all(key[1] == app.theme for key in MarkdownCache.get_instance().entries)
+
+    asyncio.run(run())
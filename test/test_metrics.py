@@ -0,0 +1,36 @@
+from core.metrics import Metrics, RequestTimer, percentile
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile([3.0], 0.95) == 3.0
+
+
+def test_turn_and_request(monkeypatch):
+    from core.Project import Project
+    metrics = Metrics()
+    monkeypatch.setattr(Metrics, "instance", metrics)
+    monkeypatch.setattr(Project, "instance", None)
+
+    metrics.begin_turn()
+    with metrics.phase("reload_file"):
+        pass
+    timer = RequestTimer("DeepSeek", "deepseek-chat")
+    timer.sent()
+    timer.chunk("思考", "")
+    timer.chunk("", "回复")
+    timer.finish({"prompt_tokens": 10, "completion_tokens": 5, "cached_tokens": 8}, "思考", "回复")
+    metrics.end_turn()
+
+    summary = metrics.summary()
+    assert list(summary["phases"]) == ["reload_file"]
+    group = summary["requests"][("DeepSeek", "deepseek-chat")]
+    assert {"send", "ttft", "first_content", "duration"} <= set(group)
+    assert metrics.requests[0]["turn"] == metrics.turns[0]["turn"]
+
+    # 命中响应缓存的请求单独记录，不计入延迟统计
+    RequestTimer("DeepSeek", "deepseek-chat").cache_hit()
+    assert metrics.requests[-1]["cached"]
+    assert len(metrics.summary()["requests"][("DeepSeek", "deepseek-chat")]["duration"]) == 1
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from core.cache import Configure
+from core.source.sources import BaseSource, SourceRegistry
+
+
+class FakeSource(BaseSource):
+    source_name = "Fake"
+
+    @classmethod
+    async def create_stream_async(cls, message):
+        async def stream():
+            for think, content in [("想", ""), ("", "你好"), ("", "<wait>")]:
+                await asyncio.sleep(0.01)
+                yield {"think": think, "content": content}
+        return stream()
+
+    @classmethod
+    def create_stream(cls, message):
+        return iter([{"think": "", "content": "同步"}])
+
+    @classmethod
+    def catch_chunk_in_stream(cls, chunk):
+        return chunk["think"], chunk["content"]
+
+
+def collect(message):
+    async def consume():
+        replay = SourceRegistry.sources["Replay"]
+        stream = await replay.create_stream_async(message)
+        return [replay.catch_chunk_in_stream(chunk) async for chunk in stream]
+    return asyncio.run(consume())
+
+
+def test_record_and_replay(monkeypatch, tmp_path):
+    configure = Configure(active_model={"Replay": "case"}, replay_mode="record", replay_target="Fake",
+                          replay_dir=str(tmp_path))
+    monkeypatch.setattr(Configure, "instance", configure)
+    monkeypatch.setitem(SourceRegistry.sources.loaded, "Fake", FakeSource)
+    message = [{"role": "user", "content": "问候"}]
+
+    expected = [("想", ""), ("", "你好"), ("", "<wait>")]
+    assert collect(message) == expected
+    cassette = json.loads(next((tmp_path / "case").glob("*.json")).read_text(encoding='utf-8'))
+    assert cassette["source"] == "Fake"
+    assert all(chunk["delay"] > 0 for chunk in cassette["chunks"])
+
+    configure.replay_mode = "replay"
+    configure.replay_speed = 0
+    assert collect(message) == expected
+
+    try:
+        collect([{"role": "user", "content": "没有录制"}])
+    except FileNotFoundError:
+        pass
+    else:
+        assert False
+
+
+def test_sync_record_and_replay(monkeypatch, tmp_path):
+    configure = Configure(active_model={"Replay": "sync"}, replay_mode="record", replay_target="Fake",
+                          replay_dir=str(tmp_path), replay_speed=0)
+    monkeypatch.setattr(Configure, "instance", configure)
+    monkeypatch.setitem(SourceRegistry.sources.loaded, "Fake", FakeSource)
+    replay = SourceRegistry.sources["Replay"]
+    message = [{"role": "user", "content": "总结"}]
+
+    assert [replay.catch_chunk_in_stream(chunk) for chunk in replay.create_stream(message)] == [("", "同步")]
+    configure.replay_mode = "replay"
+    # 同步录制的录像可以由同步与异步调用方回放
+    assert [replay.catch_chunk_in_stream(chunk) for chunk in replay.create_stream(message)] == [("", "同步")]
+    assert collect(message) == [("", "同步")]
@@ -0,0 +1,24 @@
+from core.response_cache import ResponseCache
+
+
+def test_key_ignores_extra_fields():
+    messages = [{"role": "user", "content": "总结"}]
+    assert ResponseCache.key("DeepSeek", "chat", messages) == \
+        ResponseCache.key("DeepSeek", "chat", [{"role": "user", "content": "总结", "system": True}])
+    assert ResponseCache.key("DeepSeek", "chat", messages) != ResponseCache.key("DeepSeek", "reasoner", messages)
+
+
+def test_lru_and_ttl(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    monkeypatch.setattr(ResponseCache, "MAX_BYTES", 10)
+    cache.put("a", "", "12345")
+    cache.put("b", "", "12345")
+    assert cache.get("a") == ("", "12345")
+
+    # b最久未使用，被淘汰
+    cache.put("c", "", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+    monkeypatch.setattr(ResponseCache, "TTL", -1)
+    assert cache.get("a") is None
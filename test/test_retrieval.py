@@ -0,0 +1,40 @@
+from core.retrieval import RetrievalIndex, split_chunks, tokenize
+
+
+def test_tokenize_cjk_bigrams():
+    assert tokenize("BM25检索算法") == ["bm25", "检索", "索算", "算法"]
+
+
+def test_search_incremental():
+    index = RetrievalIndex()
+    index.update("a.txt", "1", "注意力机制是Transformer的核心")
+    index.update("b.txt", "1", "卷积神经网络用于图像识别")
+    assert [chunk.source for chunk in index.search("transformer的注意力", 1)] == ["a.txt"]
+
+    assert not index.update("a.txt", "1", "内容未变化")
+    index.update("b.txt", "2", "Transformer也可以用于图像")
+    assert index.search("图像", 5)[0].source == "b.txt"
+
+    index.retain({"a.txt"})
+    assert index.search("图像", 5) == []
+    assert len(split_chunks("a" * 2000)) == 3
+
+
+def test_select_reuses_messages():
+    from core.history import Message
+    index = RetrievalIndex()
+    index.update("a.txt", "1", "注意力机制是Transformer的核心")
+    index.update("b.txt", "1", "卷积神经网络用于图像识别")
+    selected = index.select("注意力", 1)
+    assert [msg.source for msg in selected] == ["a.txt#0"]
+    assert index.select("注意力机制", 1) is selected
+    # 没有匹配时沿用上一次的片段，保存时写入完整内容
+    assert index.select("unrelated", 1) is selected
+    assert Message.from_record(selected[0].to_record()).for_model == selected[0].for_model
+
+    index.update("a.txt", "2", "图像分割")
+    assert index.select("unrelated", 1) == []
+
+    # 片段按文件与序号排列，第10个片段在第2个之后
+    index.update("c.txt", "1", "\n".join(f"段落{i} 检索" + "x" * 790 for i in range(11)))
+    assert [msg.source for msg in index.select("检索", 11)] == [f"c.txt#{i}" for i in range(11)]
@@ -0,0 +1,13 @@
+from util.sentinel import SentinelMatcher
+
+
+def test_split_across_chunks():
+    matcher = SentinelMatcher(("<wait>", "<end>"))
+    chunks = ["工具调用完成", "<", "wa", "it", ">多余内容"]
+    assert [matcher.feed(chunk) for chunk in chunks] == [None, None, None, None, "<wait>"]
+
+
+def test_earliest_sentinel():
+    matcher = SentinelMatcher(("<wait>", "<end>"))
+    assert matcher.feed("完成<e") is None
+    assert matcher.feed("nd><wait>") == "<end>"
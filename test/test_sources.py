@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import threading
+import time
+
+from core.source.sources import close_stream, iterate_in_thread
+
+
+def test_iterate_in_thread():
+    closed = threading.Event()
+
+    class SyncStream:
+        def __iter__(self):
+            for i in itertools.count():
+                time.sleep(0.001)
+                yield i
+
+        def close(self):
+            closed.set()
+
+    async def consume():
+        stream = iterate_in_thread(SyncStream)
+        received = []
+        async for chunk in stream:
+            received.append(chunk)
+            if chunk == 2:
+                break
+        await close_stream(stream)
+        return received
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+    assert closed.wait(1)
+
+
+def test_iterate_in_thread_error():
+    def create():
+        raise ValueError("连接失败")
+
+    async def consume():
+        return [chunk async for chunk in iterate_in_thread(create)]
+
+    try:
+        asyncio.run(consume())
+    except ValueError as e:
+        assert str(e) == "连接失败"
+    else:
+        assert False
+
+
+def test_client_cache(monkeypatch):
+    from core.cache import Configure
+    from core.source.sources import SourceRegistry, openai_client
+    monkeypatch.setattr(Configure, "instance", Configure(deepseek_api_key="key-1"))
+    source = SourceRegistry.sources["DeepSeek"]
+
+    client = openai_client(source, is_async=False)
+    assert openai_client(source, is_async=False) is client
+
+    Configure.instance.deepseek_api_key = "key-2"
+    assert openai_client(source, is_async=False) is not client
+
+
+def test_process_stream_stops_on_sentinel():
+    from core.communicate import process_stream
+    from core.source.sources import BaseSource
+
+    class FakeSource(BaseSource):
+        @classmethod
+        def create_stream(cls, message):
+            return iter(["你好", "<wa", "it>", "多余的内容"])
+
+        @classmethod
+        def catch_chunk_in_stream(cls, chunk):
+            return "", chunk
+
+    async def run():
+        return await process_stream(await FakeSource.create_stream_async([]), FakeSource)
+
+    assert asyncio.run(run()) == ("", "你好<wait>")
+
+
+def test_hedged_failover(monkeypatch):
+    from core.cache import Configure
+    from core.source.sources import BaseSource, SourceRegistry
+    closed = []
+
+    class SlowSource(BaseSource):
+        source_name = "Slow"
+
+        @classmethod
+        async def create_stream_async(cls, message):
+            async def stream():
+                try:
+                    await asyncio.sleep(10)
+                    yield "慢"
+                finally:
+                    closed.append(cls.source_name)
+            return stream()
+
+        @classmethod
+        def catch_chunk_in_stream(cls, chunk):
+            return "", chunk
+
+    class FastSource(SlowSource):
+        source_name = "Fast"
+
+        @classmethod
+        async def create_stream_async(cls, message):
+            async def stream():
+                yield ""
+                yield "快"
+            return stream()
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+    monkeypatch.setitem(SourceRegistry.sources.loaded, "Slow", SlowSource)
+    monkeypatch.setitem(SourceRegistry.sources.loaded, "Fast", FastSource)
+    monkeypatch.setattr(Configure, "instance", Configure(active_model={"Slow": "a", "Fast": "b"}, active_ai="Slow",
+                                                         fallback_ai="Fast", hedge_after=0.05))
+
+    sent = []
+
+    async def run():
+        source, stream, hedged = await SourceRegistry.open_stream([], on_sent=lambda: sent.append("Slow"))
+        return source, hedged, [chunk async for chunk in stream]
+
+    source, hedged, chunks = asyncio.run(run())
+    assert source is FastSource and hedged
+    # 主AI源的请求发出时即记录，不等待首token
+    assert sent == ["Slow"]
+    assert chunks == ["", "快"]
+    assert closed == ["Slow"]
+
+
+def test_communicate_keeps_sentinel(monkeypatch):
+    from core.cache import Configure
+    from core.communicate import communicate
+    from core.source.sources import BaseSource, SourceRegistry
+
+    class StopSource(BaseSource):
+        source_name = "Stop"
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        @classmethod
+        async def create_stream_async(cls, message):
+            async def stream():
+                for chunk in ["运行", "<wait>", "多余的内容"]:
+                    yield chunk
+            return stream()
+
+        @classmethod
+        def catch_chunk_in_stream(cls, chunk):
+            return "", chunk
+
+    monkeypatch.setattr(Configure, "instance", Configure(active_ai="Stop", active_model={"Stop": "m"}))
+    monkeypatch.setitem(SourceRegistry.sources.loaded, "Stop", StopSource)
+    assert asyncio.run(communicate([{"role": "user", "content": "你好"}]))[1] == "运行<wait>"
+
+
+def test_client_cache_closes_replaced(monkeypatch):
+    from core.source.sources import ClientCache
+    monkeypatch.setattr(ClientCache, "clients", {})
+    closed = []
+
+    class SyncClient:
+        def close(self):
+            closed.append("sync")
+
+    class AsyncClient:
+        async def close(self):
+            closed.append("async")
+
+    ClientCache.get("Test", False, ("a",), SyncClient)
+    ClientCache.get("Test", False, ("b",), SyncClient)
+
+    async def run():
+        ClientCache.get("Test", True, ("a",), AsyncClient)
+        ClientCache.get("Test", True, ("b",), AsyncClient)
+        await asyncio.gather(*ClientCache._closing)
+
+    asyncio.run(run())
+    assert closed == ["sync", "async"]
@@ -0,0 +1,33 @@
+from core.history import History, Message, MessageRole
+from core.token import TokenCounter, estimate_tokens
+
+
+def test_estimate_cjk():
+    # 中文按字计算，不能按字符数/4估算
+    assert estimate_tokens("今天天气很好") > estimate_tokens("abcdef")
+    assert estimate_tokens("") == 0
+
+
+def test_cache_invalidated_on_edit():
+    msg = Message(MessageRole.USER, "短", "")
+    short = msg.tokens
+    msg.for_model = "很长的一段内容" * 50
+    assert msg.tokens > short
+
+    TokenCounter.set_tokenizer(lambda text: 1)
+    try:
+        assert msg.tokens == 1 + 4
+    finally:
+        TokenCounter.set_tokenizer(None)
+
+
+def test_budget_drops_references_first():
+    history = History()
+    history.splice("prompt", [Message(MessageRole.SYSTEM, "提示词", "", tags=["prompt"], source="p")])
+    history.splice("file", [Message(MessageRole.SYSTEM, "参考" * 500, "", tags=["file"], source="f")])
+    history.add_message(MessageRole.USER, "问题", "问题")
+
+    contents = [msg["content"] for msg in history.to_message(budget=50)]
+    assert contents[0] == "提示词"
+    assert "参考" * 500 not in contents
+    assert contents[-1] == "问题"
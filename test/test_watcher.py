@@ -0,0 +1,47 @@
+import asyncio
+from pathlib import Path
+
+from core.watcher import DirectoryWatcher, FileEvent, coalesce
+
+
+def test_coalesce():
+    a, b, c = Path("a"), Path("b"), Path("c")
+    events = [FileEvent("add", a), FileEvent("modify", a), FileEvent("add", b), FileEvent("remove", b),
+              FileEvent("remove", c), FileEvent("add", c)]
+    assert coalesce(events) == [FileEvent("add", a), FileEvent("modify", c)]
+
+
+def collect_events(tmp_path, use_inotify):
+    async def run():
+        received = []
+        watcher = DirectoryWatcher(received.extend, use_inotify=use_inotify)
+        watcher.POLL_INTERVAL = 0.05
+        (tmp_path / "old.txt").write_text("旧文件")
+        (tmp_path / "keep.txt").write_text("1")
+        watcher.start()
+        watcher.set_directories([tmp_path])
+        await asyncio.sleep(0.1)
+
+        (tmp_path / "new.txt").write_text("新文件")
+        (tmp_path / "old.txt").unlink()
+        await asyncio.sleep(0.05)
+        (tmp_path / "keep.txt").write_text("22")
+        for _ in range(40):
+            await asyncio.sleep(0.05)
+            if len(received) >= 3:
+                break
+        watcher.close()
+        return watcher.backend, received
+
+    return asyncio.run(run())
+
+
+def test_watch_directory(tmp_path):
+    for use_inotify in (True, False):
+        directory = tmp_path / str(use_inotify)
+        directory.mkdir()
+        backend, events = collect_events(directory, use_inotify)
+        if not use_inotify:
+            assert backend == "polling"
+        assert set(events) == {FileEvent("add", directory / "new.txt"), FileEvent("remove", directory / "old.txt"),
+                               FileEvent("modify", directory / "keep.txt")}, backend
@@ -1,9 +1,6 @@
-import pkgutil
-import importlib
+from util.manifest import scan
+from .base_tool import ToolRegistry
 
-# 自动加载所有命令模块
-__all__ = []
-for _, module_name, _ in pkgutil.iter_modules(__path__):
-    if not module_name.startswith('_'):
-        importlib.import_module(f'.{module_name}', __name__)
-        __all__.append(module_name)
\ No newline at end of file
+# 按清单登记所有工具，实现模块在第一次解析模型输出时导入
+for entry in scan(__path__[0], __name__):
+    ToolRegistry.commands.declare(*entry.args, entry.module)
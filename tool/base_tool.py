@@ -3,7 +3,9 @@ from typing import Dict, List, Tuple, Any, Pattern
 import re
 
 from core.cache import CatchInformation, SearchResult
+from core.metrics import Metrics
 from util.fomatter import delete_think
+from util.manifest import LazyRegistry
 
 
 class BaseTool:
@@ -20,8 +22,8 @@ class BaseTool:
         raise NotImplementedError
 
 class ToolRegistry:
-    """工具注册表"""
-    commands: Dict[str, Dict[str, Any]] = {}
+    """工具注册表，遍历时导入全部工具模块"""
+    commands: LazyRegistry = LazyRegistry()  # 工具名 -> {'class': 工具类}
 
     @classmethod
     def register(cls, tool_type: str):
@@ -46,8 +48,10 @@ class ToolProcessor:
         self.command_map = {cmd['class'].tool_type: cmd['class'] for cmd in ToolRegistry.commands.values()}
 
     def process(self, content: str) -> dict:
+        metrics = Metrics.get_instance()
         content: str = delete_think(content)
-        tools: list[Tuple[str, Any]] = self.parser.parse(content)
+        with metrics.phase("tool_parse"):
+            tools: list[Tuple[str, Any]] = self.parser.parse(content)
         if "summary" in [tool[0] for tool in tools]:
             ToolProcessor.has_summary = True
 
@@ -59,7 +63,8 @@ class ToolProcessor:
 
             command_class = self.command_map[tool_type]
             command = command_class()
-            command.execute(user_output, model_output, args)
+            with metrics.phase(f"tool:{tool_type}"):
+                command.execute(user_output, model_output, args)
 
         ToolProcessor.has_summary = False
         return {
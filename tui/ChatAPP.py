@@ -1,4 +1,3 @@
-import asyncio
 from pathlib import Path
 from typing import List
 
@@ -10,17 +9,20 @@ from textual.widgets import (
     Button
 )
 
+from core.Project import Project
 from core.SurrogateIO import sio_print
 from core.cache import GlobalFlag
+from core.context import ContextAssembler
 from core.history import History
 from core.sync.Kernel import MainKernel
 from core.sync.StateManager import StateManager, State
+from core.watcher import DirectoryWatcher, FileEvent
 from tui.message import MsgType, ChatMessage, MessageDisplay
 from tui.screen.PromptScreen import PromptScreen
 from tui.screen.RenameScreen import RenameScreen
 from tui.screen.SettingsScreen import SettingsScreen
 from tui.screen.ToolScreen import ToolScreen
-from tui.widget.CombinedSidebar import CombinedSidebar
+from tui.widget.CombinedSidebar import CombinedSidebar, FileOperationMessage
 from .widget.UserInput import UserInput
 
 # 主应用类
@@ -107,29 +109,27 @@ class ChatApp(App):
     def on_mount(self) -> None:
         self.theme = "textual-light"  # 设置默认主题
         self.run_worker(self.start_core())
-        self.watch_directory("./ref_space", self.refresh_ref_space)
-        self.watch_directory("./code_space", self.refresh_code_space)
+        # 监视当前项目的参考文件、代码空间与对话历史目录，选择项目后开始
+        self.watcher = DirectoryWatcher(self.on_file_events)
+        self.watcher.start()
+
+    def on_unmount(self) -> None:
+        self.watcher.close()
 
     async def start_core(self):
         MainKernel.start_core()
 
-    def refresh_ref_space(self):
-        self.query_one(CombinedSidebar).load_space("ref")
-
-    def refresh_code_space(self):
-        self.query_one(CombinedSidebar).load_space("code")
-
-    def watch_directory(self, path: str, callback):
-        """简易目录监视"""
-        async def _watcher():
-            last_state = set()
-            while True:
-                current = set(Path(path).glob("*"))
-                if current != last_state:
-                    callback()
-                    last_state = current
-                await asyncio.sleep(1)
-        self.run_worker(_watcher())
+    def on_file_events(self, events: List[FileEvent]):
+        """项目目录中的文件变化：更新侧边栏，并使上下文组装器中对应文件的缓存失效"""
+        self.query_one(CombinedSidebar).apply_events(events)
+        ContextAssembler.get_instance().apply_events(events)
+
+    @on(FileOperationMessage)
+    def handle_file_operation(self, message: FileOperationMessage):
+        if message.action == "select_project":
+            self.watcher.set_directories(Project.instance.dirs.values())
+        elif message.action == "close_project":
+            self.watcher.set_directories([])
 
     def __init__(self):
         super().__init__()
@@ -1,6 +1,10 @@
+import bisect
+import itertools
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from colorama import Fore, Style
 from textual import on
@@ -12,9 +16,12 @@ from textual.widgets import MarkdownViewer, TextArea
 from textual.app import App, ComposeResult
 from textual.widgets import TextArea
 from textual.events import Event
+from textual.widget import Widget
 import pyperclip
+from markdown_it import MarkdownIt
 
 from core.cache import GlobalFlag
+from util.storage import text_digest
 
 
 class MsgType(Enum):
@@ -47,11 +54,95 @@ class ChatMessage:
     type: MsgType
     think: str = ""
 
+class MarkdownCache:
+    """
+    解析后的markdown文档(markdown-it的token列表)的LRU缓存，以内容哈希与主题为键
+    切换显示模式或重新加载对话时，相同的消息不再重新解析
+    解析在线程池中进行，读写需要加锁
+    """
+    instance = None
+    MAX_ENTRIES = 512
+    MIN_CHARS = 256  # 短文本解析很快，不占用缓存
+
+    def __init__(self):
+        self.entries: OrderedDict[tuple[str, str], list] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def parse(self, parser: MarkdownIt, markdown: str, theme: str) -> list:
+        if len(markdown) < self.MIN_CHARS:
+            return parser.parse(markdown)
+        key = (text_digest(markdown), theme)
+        with self.lock:
+            tokens = self.entries.get(key)
+            if tokens is not None:
+                self.entries.move_to_end(key)
+                return tokens
+        tokens = parser.parse(markdown)
+        with self.lock:
+            self.entries[key] = tokens
+            while len(self.entries) > self.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return tokens
+
+
+class CachedParser:
+    """供Markdown组件使用的解析器，use_cache为True时解析结果经过MarkdownCache"""
+
+    def __init__(self, theme: str, use_cache: bool = True):
+        self.parser = MarkdownIt("gfm-like")
+        self.theme = theme
+        self.use_cache = use_cache
+
+    def parse(self, markdown: str) -> list:
+        if not self.use_cache:
+            return self.parser.parse(markdown)
+        return MarkdownCache.get_instance().parse(self.parser, markdown, self.theme)
+
+
+@dataclass
+class RenderedMessage:
+    """已挂载的消息：消息对象、对应的组件与渲染时的内容，用于判断组件是否需要更新"""
+    message: ChatMessage
+    widget: Widget
+    content: str
+    think: str
+    raw: bool
+
+
 # 消息显示组件
 class MessageDisplay(VerticalScroll):
+    """
+    消息列表
+    虚拟化渲染：只挂载可见区域及上下OVERSCAN条消息的组件，其余消息由上下两个占位组件按高度撑开
+    未挂载过的消息使用估计的高度，挂载后记录实际高度
+    已挂载的组件按消息对象与消息列表对应，只挂载新增的消息，内容变化的消息原地更新
+    """
+    OVERSCAN = 5
     show_raw: reactive[bool] = reactive(True)
-    messages: reactive[List[ChatMessage]] = reactive([])
-    last_text: TextArea = None
+    messages: reactive[List[ChatMessage]] = reactive(list)  # 每个实例使用独立的列表
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keys: list[ChatMessage] = []  # 上次渲染时的消息列表
+        self.heights: list[int] = []  # 每条消息的高度
+        self.rendered: dict[int, RenderedMessage] = {}  # 已挂载的消息，下标 -> 组件
+        self.window: tuple[int, int] = (0, 0)
+        self._streaming = False  # 正在向Markdown组件追加流式文本
+        self._offsets: Optional[list[int]] = None  # 每条消息顶部的位置，最后一项为总高度
+        self.top_spacer = Widget(classes="message-spacer")
+        self.bottom_spacer = Widget(classes="message-spacer")
+        for spacer in (self.top_spacer, self.bottom_spacer):
+            spacer.styles.height = 0
+
+    def compose(self) -> ComposeResult:
+        yield self.top_spacer
+        yield self.bottom_spacer
 
     @on(Print)
     def on_print(self, event: Print):
@@ -76,46 +167,167 @@ class MessageDisplay(VerticalScroll):
         self.refresh_display()
 
     def watch_show_raw(self) -> None:
+        self.heights = [self._estimate(msg) for msg in self.keys]
+        self._offsets = None
         self.refresh_display()
 
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if self.is_mounted:
+            self._materialize()
+
     def refresh_display(self) -> None:
-        self.remove_children()
-        for msg in self.messages:
-            if self.show_raw:
-                self._add_raw_message(msg)
-            else:
-                self._add_rendered_message(msg)
+        """保留与消息列表前缀一致的组件，移除其余组件后显示到最新的消息"""
+        keep = 0
+        for key, msg in zip(self.keys, self.messages):
+            if key is not msg:
+                break
+            keep += 1
+        for i in [i for i in self.rendered if i >= keep]:
+            self.rendered.pop(i).widget.remove()
+        self.keys = list(self.messages)
+        del self.heights[keep:]
+        self.heights.extend(self._estimate(msg) for msg in self.keys[keep:])
+        self._offsets = None
+
+        for i, rendered in self.rendered.items():
+            if rendered.raw != self.show_raw:
+                # 切换显示模式时逐个替换组件
+                self.rendered[i] = self._build_message(rendered.message)
+                self.mount(self.rendered[i].widget, after=rendered.widget)
+                rendered.widget.remove()
+            elif rendered.content != rendered.message.content or rendered.think != rendered.message.think:
+                self._update_message(rendered)
+
+        self._materialize(tail=True)
         self.scroll_end(animate=False)
 
-    def _add_rendered_message(self, msg: ChatMessage) -> None:
+    def _estimate(self, msg: ChatMessage) -> int:
+        """按文本行数与宽度估计消息的高度，包括边框"""
+        width = max(20, self.size.width - 4)
+        text = self._raw_text(msg) if self.show_raw else self._markdown_text(msg)
+        return sum(len(line) // width + 1 for line in text.split("\n")) + 2
+
+    def _get_offsets(self) -> list[int]:
+        if self._offsets is None:
+            self._offsets = [0, *itertools.accumulate(self.heights)]
+        return self._offsets
+
+    def _materialize(self, tail: bool = False) -> None:
+        """挂载可见区域内的消息，卸载区域外的消息。tail为True时以最新的消息为可见区域"""
+        offsets = self._get_offsets()
+        count = len(self.keys)
+        viewport = self.scrollable_content_region.height or 24
+        top = max(0, offsets[-1] - viewport) if tail else int(self.scroll_y)
+        start = max(0, bisect.bisect_right(offsets, top) - 1 - self.OVERSCAN)
+        end = count if tail else min(count, bisect.bisect_left(offsets, top + viewport) + self.OVERSCAN)
+        if (start, end) == self.window and all(start <= i < end for i in self.rendered) \
+                and len(self.rendered) == end - start:
+            return
+        self.window = (start, end)
+
+        for i in [i for i in self.rendered if not start <= i < end]:
+            self.rendered.pop(i).widget.remove()
+        # 从后往前挂载，每条消息挂载在后一条消息之前，保持顺序
+        anchor = self.bottom_spacer
+        for i in range(end - 1, start - 1, -1):
+            if i not in self.rendered:
+                self.rendered[i] = self._build_message(self.keys[i])
+                self.mount(self.rendered[i].widget, before=anchor)
+            anchor = self.rendered[i].widget
+        self.top_spacer.styles.height = offsets[start]
+        self.bottom_spacer.styles.height = offsets[count] - offsets[end]
+        self.call_after_refresh(self._measure)
+
+    def _measure(self) -> None:
+        """记录已挂载消息的实际高度，与估计值不同时按实际高度重新计算窗口"""
+        changed = False
+        for i, rendered in self.rendered.items():
+            height = rendered.widget.outer_size.height
+            if height and i < len(self.heights) and height != self.heights[i]:
+                self.heights[i] = height
+                changed = True
+        if changed:
+            self._offsets = None
+            self._materialize(tail=self.is_vertical_scroll_end)
+
+    def _build_message(self, msg: ChatMessage) -> RenderedMessage:
+        widget = self._add_raw_message(msg) if self.show_raw else self._add_rendered_message(msg)
+        return RenderedMessage(msg, widget, msg.content, msg.think, self.show_raw)
+
+    def _update_message(self, rendered: RenderedMessage) -> None:
+        """更新已挂载的消息，流式输出时只追加新增的文本"""
+        msg = rendered.message
+        if rendered.raw:
+            textarea: TextArea = rendered.widget
+            if rendered.think == msg.think and msg.content.startswith(rendered.content):
+                textarea.insert(msg.content[len(rendered.content):], location=textarea.document.end)
+            else:
+                textarea.load_text(self._raw_text(msg))
+            textarea.scroll_to(textarea.document.end)
+        else:
+            if rendered not in self.rendered.values():
+                return
+            viewer = rendered.widget.query_one(MarkdownViewer)
+            if not viewer.is_mounted:
+                # 首次解析在挂载时进行，之后再更新
+                self.call_after_refresh(self._update_message, rendered)
+                return
+            if rendered.think == msg.think and msg.content.startswith(rendered.content):
+                # 流式输出只重新解析最后一个块
+                # 末尾块尚未完成，解析结果不写入缓存，避免挤出完整消息的解析结果
+                self._streaming = True
+                try:
+                    pending = viewer.document.append(msg.content[len(rendered.content):])
+                finally:
+                    self._streaming = False
+            else:
+                pending = viewer.document.update(self._markdown_text(msg))
+            # 在下一条消息之后等待更新完成，异常交给APP处理
+            pending.call_next(self)
+        rendered.content, rendered.think = msg.content, msg.think
+
+    @staticmethod
+    def _markdown_text(msg: ChatMessage) -> str:
+        if len(msg.think) != 0:
+            return "↓ AI烧烤中\n\n" + msg.think + "\n\n↑ 烧烤过程\n\n" + msg.content
+        return msg.content
+
+    @staticmethod
+    def _raw_text(msg: ChatMessage) -> str:
+        if len(msg.think) != 0:
+            return f"{msg.type.role}:\n{Fore.LIGHTBLACK_EX}{msg.think}{Style.RESET_ALL}\n\n{msg.content}"
+        return f"{msg.type.role}:\n{msg.content}"
+
+    def _parser_factory(self) -> CachedParser:
+        """Markdown组件在更新与追加时同步调用，流式追加期间返回不使用缓存的解析器"""
+        return CachedParser(self.app.theme, use_cache=not self._streaming)
+
+    def _add_rendered_message(self, msg: ChatMessage) -> Widget:
         """使用ScrollableContainer实现带边框的消息容器"""
         container = ScrollableContainer(
-            MarkdownViewer("↓ AI烧烤中\n\n" + msg.think + "\n\n↑ 烧烤过程\n\n" + msg.content if len(msg.think) != 0 else msg.content),
+            MarkdownViewer(self._markdown_text(msg), parser_factory=self._parser_factory),
             classes="message-container",
         )
         container.styles.border = ("heavy", msg.type.color)
-        self.mount(container)
+        return container
 
-    def _add_raw_message(self, msg: ChatMessage) -> None:
+    def _add_raw_message(self, msg: ChatMessage) -> Widget:
         """使用TextArea的正确配置"""
-        if len(msg.think) != 0:
-            res = f"{msg.type.role}:\n{Fore.LIGHTBLACK_EX}{msg.think}{Style.RESET_ALL}\n\n{msg.content}"
-        else:
-            res = f"{msg.type.role}:\n{msg.content}"
         textarea = CopyText(
-            text=res,
+            text=self._raw_text(msg),
             read_only=True,
             language=None,  # 禁用语法高亮
             classes="raw-message",
         )
         textarea.styles.background = msg.type.color
-        MessageDisplay.last_text = textarea
-        self.mount(textarea)
+        return textarea
 
     def add_content(self, content: str):
-        if self.show_raw:
-            MessageDisplay.last_text.insert(content, location=MessageDisplay.last_text.document.end)
-            MessageDisplay.last_text.scroll_to(MessageDisplay.last_text.document.end)
+        """流式输出写入最后一条消息后更新对应的组件"""
+        last = len(self.keys) - 1
+        if last in self.rendered and self.messages and self.rendered[last].message is self.messages[-1]:
+            self._update_message(self.rendered[last])
 
 
 class CopyText(TextArea):
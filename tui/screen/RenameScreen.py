@@ -90,8 +90,7 @@ class RenameScreen(ModalScreen):
 
         history_dir = Project.instance.root_path / "history"
 
-        # 构建新旧路径
-        old_path = history_dir / f"{history.name}.json"
+        # 构建新路径
         new_path = history_dir / f"{new_name}.json"
 
         if new_path.exists():
@@ -99,11 +98,8 @@ class RenameScreen(ModalScreen):
             return
 
         try:
-            # 执行重命名
-            if old_path.exists():
-                old_path.rename(new_path)
-            history.name = new_name  # 更新当前历史名称
-            history.save()  # 立即保存
+            # 执行重命名，快照与日志一同移动，并立即保存
+            history.rename(new_name)
 
             self.dismiss()
 
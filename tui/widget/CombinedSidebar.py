@@ -7,19 +7,21 @@ from typing import Optional
 from textual import on
 from textual.message import Message
 from textual.widgets import Tree
+from textual.widgets.tree import TreeNode
 
 from core.Project import Project
 from core.cache import GlobalFlag
-from core.history import History
+from core.history import History, HistoryIndex
 from core.sync.Kernel import MainKernel
 from core.sync.StateManager import StateManager, State
+from core.watcher import FileEvent
 from tui.message import ChatMessage, MsgType
 
 
 class FileOperationMessage(Message):
     """文件操作消息"""
     def __init__(self, action: str, path: str) -> None:
-        self.action = action  # add/delete/select_project
+        self.action = action  # add/delete/select_project/close_project
         self.path = path
         super().__init__()
 
@@ -31,6 +33,10 @@ class CombinedSidebar(Tree):
         super().__init__("项目空间", id="sidebar")
         self.projects_root = self.root.add("· 项目", expand=True)
         self.current_project: Optional[Project] = None
+        self.file_nodes: dict[str, dict[str, TreeNode]] = {"ref": {}, "code": {}}  # 空间 -> {文件路径: 节点}
+        self.new_file_nodes: dict[str, TreeNode] = {}  # 空间 -> "添加文件"节点
+        self.history_nodes: dict[str, TreeNode] = {}  # 对话名 -> 节点
+        self.new_history_node: Optional[TreeNode] = None
 
         # 初始化项目目录
         self.projects_dir = Path("./projects")
@@ -52,6 +58,9 @@ class CombinedSidebar(Tree):
     def load_projects(self):
         """加载所有项目"""
         Project.instance = None
+        if self.current_project is not None:
+            self.current_project = None
+            self.post_message(FileOperationMessage("close_project", ""))
         self.root.remove_children()
         self.add_project_root()
         self.projects_root.remove_children()
@@ -63,6 +72,9 @@ class CombinedSidebar(Tree):
         """加载当前项目内容"""
         # 清空历史节点
         self.root.remove_children()
+        self.file_nodes = {"ref": {}, "code": {}}
+        self.new_file_nodes = {}
+        self.history_nodes = {}
 
         # 添加项目相关内容
         if self.current_project:
@@ -70,33 +82,79 @@ class CombinedSidebar(Tree):
             self.ref_root = self.root.add(f"参考文件", expand=True)
             self.code_root = self.root.add(f"代码空间", expand=True)
             self.return_root = self.root.add("← 返回", {"type": "return"})
+            self.new_history_node = self.history_root.add_leaf("+ 新建对话", {"type": "new_history"})
 
             self.load_history()
             self.load_space("ref")
             self.load_space("code")
 
     def load_history(self):
-        """加载当前项目历史记录"""
-        self.history_root.remove_children()
-        for file in self.current_project.dirs["history"].glob("*.json"):
-            self.history_root.add_leaf(
-                file.stem,
-                {"type": "history", "path": str(file)}
-            )
-        self.history_root.add_leaf("+ 新建对话", {"type": "new_history"})
+        """加载当前项目历史记录，从索引读取标题与消息数，只增删变化的节点"""
+        entries = HistoryIndex.get_instance().listing()
+        for name in [name for name in self.history_nodes if name not in entries]:
+            self.history_nodes.pop(name).remove()
+        for name in sorted(entries):
+            entry = entries[name]
+            label = entry["title"] if entry["messages"] is None else f"{entry['title']} ({entry['messages']})"
+            node = self.history_nodes.get(name)
+            if node is None:
+                self.history_nodes[name] = self.history_root.add_leaf(
+                    label,
+                    {"type": "history", "path": str(History.snapshot_file(name))},
+                    before=self.new_history_node
+                )
+            elif str(node.label) != label:
+                node.set_label(label)
 
     def load_space(self, space_type: str):
-        """加载指定空间内容"""
+        """加载指定空间内容，只增删变化的节点"""
+        root = self.ref_root if space_type == "ref" else self.code_root
+        if space_type not in self.new_file_nodes:
+            self.new_file_nodes[space_type] = root.add_leaf("+ 添加文件", {"type": f"new_{space_type}"})
+        nodes = self.file_nodes[space_type]
+        files = {str(file): file for file in self.current_project.dirs[space_type].glob("*") if file.is_file()}
+        for path in [path for path in nodes if path not in files]:
+            nodes.pop(path).remove()
+        for path in sorted(files):
+            self._add_file_node(space_type, files[path])
+
+    def _add_file_node(self, space_type: str, file: Path):
+        nodes = self.file_nodes[space_type]
+        if str(file) in nodes:
+            return
         root = self.ref_root if space_type == "ref" else self.code_root
-        root.remove_children()
+        nodes[str(file)] = root.add_leaf(
+            f" {file.name}",
+            {"type": space_type, "path": str(file)},
+            before=self.new_file_nodes[space_type]
+        )
 
-        for file in self.current_project.dirs[space_type].glob("*"):
-            if file.is_file():
-                root.add_leaf(
-                    f" {file.name}",
-                    {"type": space_type, "path": str(file)}
-                )
-        root.add_leaf("+ 添加文件", {"type": f"new_{space_type}"})
+    def apply_events(self, events: list[FileEvent]):
+        """根据目录监视的事件增删文件节点，对话记录变化时重新加载历史列表"""
+        if self.current_project is None:
+            return
+        dirs = self.current_project.dirs
+        spaces = {dirs["ref"]: "ref", dirs["code"]: "code"}
+        history_changed = False
+        for event in events:
+            directory = event.path if event.kind == "rescan" else event.path.parent
+            if directory == dirs["history"]:
+                # 对话记录保存时同时更新索引，索引变化即可反映新增、删除与标题的变化
+                history_changed |= event.kind == "rescan" or event.path.name == HistoryIndex.FILE \
+                    or (event.kind == "remove" and event.path.suffix == ".json")
+                continue
+            space_type = spaces.get(directory)
+            if space_type is None:
+                continue
+            nodes = self.file_nodes[space_type]
+            if event.kind == "rescan":
+                self.load_space(space_type)
+            elif event.kind == "add":
+                self._add_file_node(space_type, event.path)
+            elif event.kind == "remove" and str(event.path) in nodes:
+                nodes.pop(str(event.path)).remove()
+        if history_changed:
+            self.load_history()
 
     @on(Tree.NodeSelected)
     async def handle_selection(self, event: Tree.NodeSelected):
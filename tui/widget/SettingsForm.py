@@ -80,6 +80,43 @@ class SettingsForm(VerticalScroll):
             classes="setting-item"
         )
 
+        # 最大上下文token数
+        yield Horizontal(
+            Label("最大上下文token:"),
+            Input(
+                str(config.max_context_tokens),
+                placeholder="-1表示无限制",
+                validators=[Number(minimum=-1)],
+                type="integer",
+                id="max-context-tokens"
+            ),
+            classes="setting-item"
+        )
+
+        # 参考文献检索
+        yield Horizontal(
+            Label("检索片段数:"),
+            Input(
+                str(config.ref_top_k),
+                placeholder="每轮注入的参考文献片段数",
+                validators=[Number(minimum=1)],
+                type="integer",
+                id="ref-top-k"
+            ),
+            classes="setting-item"
+        )
+        yield Horizontal(
+            Label("全文注入上限token:"),
+            Input(
+                str(config.ref_full_inject_tokens),
+                placeholder="-1表示总是注入全文",
+                validators=[Number(minimum=-1)],
+                type="integer",
+                id="ref-full-inject-tokens"
+            ),
+            classes="setting-item"
+        )
+
     def get_current_model(self) -> str:
         """获取当前AI源对应的模型名称"""
         if not self.config.active_ai:
@@ -122,6 +159,16 @@ class SettingsForm(VerticalScroll):
             max_skip = self.query_one("#max-skip-input").value
             config.max_skip_input_turn = int(max_skip) if max_skip else -1
 
+            # 保存最大上下文token数
+            max_tokens = self.query_one("#max-context-tokens").value
+            config.max_context_tokens = int(max_tokens) if max_tokens else -1
+
+            # 保存参考文献检索设置
+            top_k = self.query_one("#ref-top-k").value
+            config.ref_top_k = int(top_k) if top_k else 8
+            full_inject = self.query_one("#ref-full-inject-tokens").value
+            config.ref_full_inject_tokens = int(full_inject) if full_inject else -1
+
             config.save()
 
         except ValueError as e:
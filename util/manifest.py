@@ -0,0 +1,105 @@
+# 插件清单
+# 命令、工具与AI源的模块通过装饰器注册。启动时只用ast读取装饰器的参数得到清单，实现模块在第一次使用时才导入
+import ast
+import importlib
+import sys
+import time
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+# 已导入的插件模块及导入耗时(秒)，/imports 命令据此生成报告
+IMPORT_TIMES: dict[str, float] = {}
+# 清单中出现的全部插件模块
+PLUGIN_MODULES: set[str] = set()
+
+
+@dataclass
+class ManifestEntry:
+    """一次注册的清单条目: 装饰器的参数与所在模块"""
+    module: str
+    args: list = field(default_factory=list)
+    kwargs: dict = field(default_factory=dict)
+
+
+def scan(package_path: str, package: str) -> list[ManifestEntry]:
+    """
+    扫描包目录下的模块，收集类上 xxx.register(...) 装饰器的参数，不导入模块
+    参数必须是字面量，无法静态求值的参数被忽略
+    """
+    entries = []
+    for file in sorted(Path(package_path).glob("*.py")):
+        if file.stem.startswith('_'):
+            continue
+        module = f"{package}.{file.stem}"
+        tree = ast.parse(file.read_text(encoding='utf-8'), filename=str(file))
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for decorator in node.decorator_list:
+                if not (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute)
+                        and decorator.func.attr == "register"):
+                    continue
+                entry = ManifestEntry(module)
+                try:
+                    entry.args = [ast.literal_eval(arg) for arg in decorator.args]
+                    entry.kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in decorator.keywords}
+                except ValueError:
+                    continue
+                entries.append(entry)
+                PLUGIN_MODULES.add(module)
+    return entries
+
+
+def import_plugin(module: str):
+    """导入插件模块并记录耗时"""
+    if module in sys.modules:
+        return sys.modules[module]
+    start = time.perf_counter()
+    result = importlib.import_module(module)
+    IMPORT_TIMES.setdefault(module, time.perf_counter() - start)
+    return result
+
+
+class LazyRegistry(MutableMapping):
+    """
+    按需导入的注册表，名称在清单中已知，取值时才导入实现模块
+    实现模块导入时通过注册装饰器写入真正的值
+    """
+
+    def __init__(self):
+        self.modules: dict[str, str] = {}  # 名称 -> 实现模块
+        self.loaded: dict[str, Any] = {}
+
+    def declare(self, name: str, module: str):
+        self.modules.setdefault(name, module)
+
+    def __getitem__(self, name: str):
+        if name not in self.loaded and name in self.modules:
+            import_plugin(self.modules[name])
+        return self.loaded[name]
+
+    def __setitem__(self, name: str, value):
+        self.loaded[name] = value
+
+    def __delitem__(self, name: str):
+        self.loaded.pop(name, None)
+        self.modules.pop(name, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys([*self.modules, *self.loaded]))
+
+    def __len__(self) -> int:
+        return len(set(self.modules) | set(self.loaded))
+
+    def __contains__(self, name) -> bool:
+        return name in self.modules or name in self.loaded
+
+    def load_all(self):
+        """导入清单中的全部模块"""
+        for name in list(self.modules):
+            self[name]
+
+    def __repr__(self):
+        return repr(list(self))
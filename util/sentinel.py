@@ -0,0 +1,26 @@
+from typing import Iterable, Optional
+
+
+class SentinelMatcher:
+    """
+    在流式文本中增量匹配标记，标记可以被切分到任意多个chunk中
+    只保留长度为(最长标记长度-1)的尾部，每个chunk的开销只与chunk长度有关，与已接收的总长度无关
+    """
+
+    def __init__(self, sentinels: Iterable[str]):
+        self.sentinels = tuple(sentinels)
+        self.keep = max(len(sentinel) for sentinel in self.sentinels) - 1
+        self.tail = ""
+
+    def feed(self, text: str) -> Optional[str]:
+        """接收一段文本，返回最先出现的标记，没有匹配时返回None"""
+        if not text:
+            return None
+        window = self.tail + text
+        found, position = None, len(window)
+        for sentinel in self.sentinels:
+            index = window.find(sentinel)
+            if index != -1 and index < position:
+                found, position = sentinel, index
+        self.tail = window[max(0, len(window) - self.keep):]
+        return found
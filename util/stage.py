@@ -0,0 +1,30 @@
+from typing import Callable, Iterable
+
+
+class StageCache:
+    """
+    消息转换阶段的缓存
+    按输入消息对象缓存单条消息的转换结果，同一个消息字典在多轮请求中只转换一次
+    只保留最近一次调用用到的条目，缓存大小不超过消息数
+    输入的消息字典在传入后不能被修改
+    """
+
+    def __init__(self, transform: Callable[[dict], object]):
+        self.transform = transform
+        self.cache: dict[int, tuple[dict, object]] = {}
+
+    def __call__(self, messages: Iterable[dict]) -> list:
+        cache = {}
+        result = []
+        for msg in messages:
+            hit = self.cache.get(id(msg))
+            # 保存原对象的引用，避免对象被回收后id被复用
+            if hit is None or hit[0] is not msg:
+                hit = (msg, self.transform(msg))
+            cache[id(msg)] = hit
+            result.append(hit[1])
+        self.cache = cache
+        return result
+
+    def clear(self):
+        self.cache = {}
@@ -0,0 +1,38 @@
+# 持久化存储共用的工具
+# 对话记录、提取缓存与索引都通过atomic_write写入，崩溃时的保证一致；各类缓存的键都用同一种内容哈希
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Union
+
+DIGEST_SIZE = 16  # blake2b摘要的字节数
+
+
+def atomic_write(path: Path, data: Union[str, bytes]):
+    """
+    先写入临时文件并刷新到磁盘再替换，崩溃时目标文件要么是旧内容，要么是完整的新内容
+    临时文件名包含进程与线程标识，多个线程同时写同一个文件时互不覆盖
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open('wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def text_digest(text: str) -> str:
+    """文本的内容哈希"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    """文件的内容哈希，分块读取，大文件不会一次读入内存"""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with path.open('rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()